@@ -0,0 +1,303 @@
+# This code is in Public Domain. Take all the code you want, we'll just write more.
+import urllib, copy, logging
+from google.appengine.api import memcache
+from google.appengine.ext import db
+from common import *
+import startup
+
+# responds to GET /manageforums[?forum=<key>&disable=yes&enable=yes]
+# and POST /manageforums with values from the form
+class ManageForums(FofouHandler):
+
+  def post(self):
+    if not self.ctx.is_admin:
+      return self.redirect("/")
+
+    forum_key = self.request.get('forum_key')
+    forum = None
+    if forum_key:
+      forum = db.get(db.Key(forum_key))
+      if not forum:
+        # invalid key - should not happen so go to top-level
+        return self.redirect("/")
+
+    vals = ['url','title', 'tagline', 'sidebar', 'disable', 'enable', 'importsecret', 'analyticscode']
+    (url, title, tagline, sidebar, disable, enable, import_secret, analytics_code) = req_get_vals(self.request, vals)
+
+    errmsg = None
+    if not valid_forum_url(url):
+      errmsg = "Url contains illegal characters"
+    if not forum:
+      forum_exists = Forum.gql("WHERE url = :1", url).get()
+      if forum_exists:
+        errmsg = "Forum with this url already exists"
+
+    if errmsg:
+      tvals = {
+        'urlclass' : "error",
+        'hosturl' : self.request.host_url,
+        'prevurl' : url,
+        'prevtitle' : title,
+        'prevtagline' : tagline,
+        'prevsidebar' : sidebar,
+        'previmportsecret' : import_secret,
+        'prevanalyticscode' : analytics_code,
+        'forum_key' : forum_key,
+        'errmsg' : errmsg
+      }
+      return self.render_rest(tvals)
+
+    title_or_url = title or url
+    if forum:
+      # update existing forum
+      forum.url = url
+      forum.title = title
+      forum.tagline = tagline
+      forum.sidebar = sidebar
+      forum.import_secret = import_secret
+      forum.analytics_code = analytics_code
+      forum.put()
+      invalidate_topic_list(forum)
+      invalidate_feeds(forum)
+      msg = "Forum '%s' has been updated." % title_or_url
+    else:
+      # create a new forum
+      forum = Forum(url=url, title=title, tagline=tagline, sidebar=sidebar, import_secret = import_secret, analytics_code = analytics_code)
+      forum.put()
+      msg = "Forum '%s' has been created." % title_or_url
+    invalidate_forums()
+    url = "/manageforums?msg=%s" % urllib.quote(msg)
+    return self.redirect(url)
+
+  def get(self):
+    if not self.ctx.is_admin:
+      return self.redirect("/")
+
+    # if there is 'forum_key' argument, this is editing an existing forum.
+    forum = None
+    forum_key = self.request.get('forum_key')
+    if forum_key:
+      forum = db.get(db.Key(forum_key))
+      if not forum:
+        # invalid forum key - should not happen, return to top level
+        return self.redirect("/")
+
+    tvals = {
+      'hosturl' : self.request.host_url,
+      'forum' : forum
+    }
+    if forum:
+      disable = self.request.get('disable')
+      enable = self.request.get('enable')
+      if disable or enable:
+        title_or_url = forum.title or forum.url
+        if disable:
+          forum.is_disabled = True
+          forum.put()
+          msg = "Forum %s has been disabled." % title_or_url
+        else:
+          forum.is_disabled = False
+          forum.put()
+          msg = "Forum %s has been enabled." % title_or_url
+        invalidate_feeds(forum)
+        invalidate_forums()
+        return self.redirect("/manageforums?msg=%s" % urllib.quote(msg))
+    self.render_rest(tvals, forum)
+
+  def render_rest(self, tvals, forum=None):
+    user = self.ctx.user
+    forums = []
+    for f in get_forums():
+      # forums from the registry are shared, so decorate a copy
+      f = copy.copy(f)
+      edit_url = "/manageforums?forum_key=" + str(f.key())
+      if f.is_disabled:
+        f.enable_disable_txt = "enable"
+        f.enable_disable_url = edit_url + "&enable=yes"
+      else:
+        f.enable_disable_txt = "disable"
+        f.enable_disable_url = edit_url + "&disable=yes"      
+      if forum and f.key() == forum.key():
+        # editing existing forum
+        f.no_edit_link = True
+        tvals['prevurl'] = f.url
+        tvals['prevtitle'] = f.title
+        tvals['prevtagline'] = f.tagline
+        tvals['prevsidebar'] = f.sidebar
+        tvals['previmportsecret'] = f.import_secret
+        tvals['prevanalyticscode'] = f.analytics_code
+        tvals['forum_key'] = str(f.key())
+      forums.append(f)
+    tvals['msg'] = self.request.get('msg')
+    tvals['user'] = user
+    tvals['forums'] = forums
+    template_out(self.response, "manage_forums.html", tvals)
+
+# Maintenance jobs process all entities of a given kind in a forum in
+# batches, in key order. start() is called before the first batch, finish()
+# after the last one and process() returns a list of entities from a batch
+# that need to be saved
+class MaintenanceJob(object):
+  model = None
+
+  def start(self, forum):
+    pass
+
+  def process(self, forum, entities):
+    return []
+
+  def finish(self, forum):
+    pass
+
+# re-renders posts not rendered with current MESSAGE_RENDERER_VERSION
+class RerenderJob(MaintenanceJob):
+  model = Post
+
+  def process(self, forum, posts):
+    res = []
+    for post in posts:
+      if post.message_html is None or post.message_html_version != MESSAGE_RENDERER_VERSION:
+        post.render_html()
+        res.append(post)
+    return res
+
+# recomputes Topic.ncomments and forum's topics/posts counters from Posts,
+# fixing any drift. Forum totals are accumulated in "recount:" counters
+# and copied to real counters after the last batch
+class RecountJob(MaintenanceJob):
+  model = Topic
+
+  def start(self, forum):
+    set_forum_counter(forum, "recount:topics", 0)
+    set_forum_counter(forum, "recount:posts", 0)
+
+  def process(self, forum, topics):
+    (ntopics, nposts) = (0, 0)
+    res = []
+    for topic in topics:
+      # count() is capped at 1000, keys are read in batches instead
+      count = 0
+      for key in iter_keys("Post", "topic = :1 AND is_deleted = False", topic.key()):
+        count += 1
+      nposts += count
+      # first post isn't counted, unless it's deleted
+      ncomments = count
+      if not topic.is_deleted:
+        ntopics += 1
+        ncomments = max(0, count - 1)
+      if ncomments != topic.ncomments:
+        logging.info("topic %d: fixing ncomments from %d to %d" % (topic.key().id(), topic.ncomments, ncomments))
+        topic.ncomments = ncomments
+        res.append(topic)
+    incr_forum_counter(forum, "recount:topics", ntopics)
+    incr_forum_counter(forum, "recount:posts", nposts)
+    return res
+
+  def finish(self, forum):
+    for name in ["topics", "posts"]:
+      set_forum_counter(forum, name, get_forum_counter(forum, "recount:" + name))
+    invalidate_topic_list(forum)
+
+# sets first post, excerpt and last post on topics, for topics created
+# before these were stored in Topic
+class MigrateTopicsJob(MaintenanceJob):
+  model = Topic
+
+  def process(self, forum, topics):
+    res = []
+    for topic in topics:
+      if topic.msg_short is not None:
+        continue
+      first_post = Post.gql("WHERE topic = :1 ORDER BY created_on", topic).get()
+      if not first_post:
+        continue
+      topic.set_first_post(first_post)
+      topic.set_last_post(topic.query_last_post())
+      res.append(topic)
+    return res
+
+# creates PostDigest entities for existing posts and builds the bloom
+# filter of digests
+class DigestsJob(MaintenanceJob):
+  model = Post
+
+  def start(self, forum):
+    start_digest_bloom(forum)
+
+  def process(self, forum, posts):
+    add_to_digest_bloom(forum, [post.sha1_digest for post in posts])
+    return make_post_digests(forum, posts)
+
+  def finish(self, forum):
+    if not finish_digest_bloom(forum):
+      logging.info("digest bloom filter for '%s' was evicted from memcache, job needs to be re-run" % forum.url)
+
+# rebuilds search index of topics from their posts
+class SearchIndexJob(MaintenanceJob):
+  model = Topic
+
+  def process(self, forum, topics):
+    res = []
+    for topic in topics:
+      if topic.is_deleted:
+        delete_topic_index(topic)
+        continue
+      posts = Post.gql("WHERE topic = :1 AND is_deleted = False", topic).fetch(SEARCH_MAX_POSTS)
+      res.append(make_topic_index(topic, posts))
+    return res
+
+MAINTENANCE_JOBS = {
+  "rerender" : RerenderJob(),
+  "recount" : RecountJob(),
+  "topics" : MigrateTopicsJob(),
+  "digests" : DigestsJob(),
+  "search" : SearchIndexJob(),
+}
+
+MAINTENANCE_BATCH_SIZE = 100
+
+# responds to /<forumurl>/maintenance?job=<job>[&after=<key>]
+# processes one batch of entities and links to the next one
+class Maintenance(FofouHandler):
+
+  def get(self):
+    (forum, siteroot, tmpldir) = forum_siteroot_tmpldir_from_url(self.request.path_info)
+    if not forum:
+      return self.redirect("/")
+    if not self.ctx.is_admin:
+      return self.redirect(siteroot)
+    job = self.request.get('job')
+    if job not in MAINTENANCE_JOBS:
+      return self.error(HTTP_NOT_FOUND)
+    job_impl = MAINTENANCE_JOBS[job]
+    model = job_impl.model
+    after = self.request.get('after')
+    if after:
+      q = model.gql("WHERE forum = :1 AND __key__ > :2 ORDER BY __key__", forum, db.Key(after))
+    else:
+      job_impl.start(forum)
+      q = model.gql("WHERE forum = :1 ORDER BY __key__", forum)
+    entities = q.fetch(MAINTENANCE_BATCH_SIZE)
+    to_put = job_impl.process(forum, entities)
+    if to_put:
+      db.put(to_put)
+    if len(entities) < MAINTENANCE_BATCH_SIZE:
+      job_impl.finish(forum)
+    self.response.headers['Content-Type'] = 'text/plain'
+    self.response.out.write("job '%s': processed %d, updated %d\n" % (job, len(entities), len(to_put)))
+    if len(entities) == MAINTENANCE_BATCH_SIZE:
+      next_url = "%smaintenance?job=%s&after=%s" % (siteroot, job, str(entities[-1].key()))
+      self.response.out.write("next batch: %s%s\n" % (self.request.host_url, next_url))
+    else:
+      self.response.out.write("done\n")
+
+# responds to /startuptimes, admin only. Shows how long importing each module
+# took in the instance that handles the request
+class StartupTimes(FofouHandler):
+
+  def get(self):
+    if not self.ctx.is_admin:
+      return self.redirect("/")
+    self.response.headers['Content-Type'] = 'text/plain'
+    for (name, dur) in startup.g_import_times:
+      self.response.out.write("%-40s %8.1f ms\n" % (name, dur))
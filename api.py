@@ -0,0 +1,160 @@
+# This code is in Public Domain. Take all the code you want, we'll just write more.
+import re, sha, time
+from google.appengine.api import memcache
+from google.appengine.ext import db
+from django.utils import simplejson
+from common import *
+
+# Read-only JSON api, for embedding forums in other sites and rendering them
+# with javascript (see static/fofou_api.js). It returns the same data
+# anonymous users see on topic list and topic pages, with messages already
+# formatted as html. Given callback=<name> parameter, responses are JSONP
+
+g_callback_re = re.compile(r"^[A-Za-z_$][A-Za-z0-9_$.]*$")
+
+def json_datetime(dt):
+  if dt is None:
+    return None
+  return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def forum_json(forum):
+  return {
+    'url' : forum.url,
+    'title' : forum.title or forum.url,
+    'tagline' : forum.tagline,
+  }
+
+def topic_json(topic):
+  return {
+    'id' : topic.key().id(),
+    'subject' : topic.subject,
+    'created_by' : topic.created_by,
+    'created_on' : json_datetime(topic.created_on),
+    'ncomments' : topic.ncomments,
+    'msg_short' : topic.msg_short,
+    'last_post_on' : json_datetime(topic.last_post_on),
+    'last_post_by' : topic.last_post_by,
+  }
+
+# e-mail addresses aren't exposed, has_email tells if /email form can be used
+def post_json(post):
+  return {
+    'id' : post.key().id(),
+    'user_name' : post.user_name,
+    'user_homepage' : post.user_homepage,
+    'has_email' : bool(post.user_email),
+    'created_on' : json_datetime(post.created_on),
+    'html' : post.html(),
+  }
+
+def json_dumps(data):
+  return simplejson.dumps(data, separators=(',', ':'))
+
+class ApiHandler(FofouHandler):
+
+  # writes JSON text (wrapped in a call to callback function, if given)
+  # unless client's copy, identified by etag, is up-to-date. gztxt is
+  # cached gzip version of txt, only used without callback
+  def json_out(self, txt, gztxt, etag, last_modified, max_age):
+    callback = self.request.get('callback')
+    if callback:
+      if not g_callback_re.match(callback):
+        return self.error(HTTP_NOT_ACCEPTABLE)
+      etag = '"%s"' % sha.new(etag + callback).hexdigest()
+      self.response.headers['Content-Type'] = 'application/javascript; charset=utf-8'
+    else:
+      self.response.headers['Content-Type'] = 'application/json; charset=utf-8'
+    set_cache_control(self.response, max_age)
+    self.response.headers['Access-Control-Allow-Origin'] = '*'
+    gzip_fn = None
+    if callback:
+      txt = "%s(%s);" % (callback, txt)
+    elif gztxt:
+      gzip_fn = lambda: gztxt
+    compressed_out(self.request, self.response, txt, gzip_fn, etag, last_modified)
+
+# responds to /<forumurl>/api/topics[?after=<token>], returns a page of
+# topic list
+class ApiTopics(ApiHandler):
+
+  def get(self):
+    (forum, siteroot, tmpldir) = forum_siteroot_tmpldir_from_url(self.request.path_info)
+    if not forum or forum.is_disabled:
+      return self.error(HTTP_NOT_FOUND)
+    after_token = self.request.get('after')
+    if not decode_page_token(after_token):
+      after_token = ""
+    # cached per generation of the topic list, like topic list pages
+    key = "api:" + topic_list_memcached_key(forum, False, after_token, "")
+    cached = memcache.get(key)
+    if cached is None:
+      txt = self.topics_json(forum, after_token)
+      cached = (txt, gzip_variant(txt), '"%s"' % sha.new(txt).hexdigest(), int(time.time()))
+      memcache.set(key, cached)
+    (txt, gztxt, etag, last_modified) = cached
+    self.json_out(txt, gztxt, etag, last_modified, LIVE_MAX_AGE)
+
+  def topics_json(self, forum, after_token):
+    after = decode_page_token(after_token)
+    start = 0
+    if after:
+      start = after[2]
+    (topics, has_more) = get_topics_page(forum, False, after)
+    next_page = None
+    if has_more:
+      next_page = encode_page_token(topics[-1], start + len(topics))
+    data = {
+      'forum' : forum_json(forum),
+      'topics' : [topic_json(topic) for topic in topics],
+      'next' : next_page,
+      'ntopics' : get_forum_counter(forum, "topics"),
+      'nposts' : get_forum_counter(forum, "posts"),
+    }
+    return json_dumps(data)
+
+# responds to /<forumurl>/api/topic?id=<id>[&after=<token>], returns a topic
+# with a page of its posts
+class ApiTopic(ApiHandler):
+
+  def get(self):
+    (forum, siteroot, tmpldir) = forum_siteroot_tmpldir_from_url(self.request.path_info)
+    if not forum or forum.is_disabled:
+      return self.error(HTTP_NOT_FOUND)
+    topic_id = self.request.get('id')
+    if not topic_id.isdigit():
+      return self.error(HTTP_NOT_FOUND)
+    topic = db.get(db.Key.from_path('Topic', int(topic_id)))
+    if not topic or topic.is_deleted or Topic.forum.get_value_for_datastore(topic) != forum.key():
+      return self.error(HTTP_NOT_FOUND)
+
+    is_archived = is_topic_archived(topic)
+    max_age = LIVE_MAX_AGE
+    if is_archived:
+      max_age = ARCHIVED_MAX_AGE
+    # topic only changes when posts are added or (un)deleted, so we know
+    # if the client is up-to-date before reading posts
+    after_token = self.request.get('after')
+    after = decode_page_token(after_token)
+    if not after:
+      after_token = ""
+    etag = topic_etag(topic, "api:%d:%s:%s" % (is_archived, forum_fingerprint(forum), after_token))
+    last_modified = datetime_to_usec(topic.updated_on) / 1000000
+    key = "api:topic:" + etag
+    cached = memcache.get(key)
+    if cached is None:
+      (posts, has_more) = get_topic_posts(forum, topic, False, after)
+      next_page = None
+      if has_more:
+        next_page = next_page_token(posts, after)
+      data = {
+        'forum' : forum_json(forum),
+        'topic' : topic_json(topic),
+        'archived' : is_archived,
+        'posts' : [post_json(post) for post in posts],
+        'next' : next_page,
+      }
+      txt = json_dumps(data)
+      cached = (txt, gzip_variant(txt))
+      memcache.set(key, cached)
+    (txt, gztxt) = cached
+    self.json_out(txt, gztxt, etag, last_modified, max_age)
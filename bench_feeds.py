@@ -0,0 +1,89 @@
+# This code is in Public Domain. Take all the code you want, we'll just write more.
+#!/usr/bin/env python
+import os, sys, time, datetime
+
+# Counts datastore calls needed to build /rss and /rssall feeds. Runs against
+# local datastore/memcache stubs from App Engine SDK, so it doesn't need
+# a server. Usage:
+#   python bench_feeds.py [path to App Engine SDK]
+
+APPENGINE_SDK = "/usr/local/google_appengine"
+
+APP_ID = "fofou-bench"
+NTOPICS = 30
+NPOSTS_PER_TOPIC = 3
+
+def setup_sdk(sdk):
+  sys.path = [sdk,
+    os.path.join(sdk, "lib", "django"),
+    os.path.join(sdk, "lib", "webob"),
+    os.path.join(sdk, "lib", "yaml", "lib")] + sys.path
+  os.environ["APPLICATION_ID"] = APP_ID
+  os.environ["AUTH_DOMAIN"] = "gmail.com"
+  os.environ["SERVER_NAME"] = "localhost"
+  os.environ["USER_EMAIL"] = ""
+
+g_calls = {}
+def count_call(service, call, request, response):
+  g_calls[call] = g_calls.get(call, 0) + 1
+
+def setup_stubs():
+  from google.appengine.api import apiproxy_stub_map, datastore_file_stub
+  from google.appengine.api import user_service_stub
+  from google.appengine.api.memcache import memcache_stub
+  apiproxy_stub_map.apiproxy = apiproxy_stub_map.APIProxyStubMap()
+  stub = datastore_file_stub.DatastoreFileStub(APP_ID, None, None)
+  apiproxy_stub_map.apiproxy.RegisterStub("datastore_v3", stub)
+  apiproxy_stub_map.apiproxy.RegisterStub("memcache", memcache_stub.MemcacheService())
+  apiproxy_stub_map.apiproxy.RegisterStub("user", user_service_stub.UserServiceStub())
+  apiproxy_stub_map.apiproxy.GetPreCallHooks().Append("count_calls", count_call, "datastore_v3")
+
+def create_forum(feeds):
+  forum = feeds.Forum(url="bench", title="Benchmark forum")
+  forum.put()
+  user = feeds.FofouUser(cookie=feeds.new_user_id(), name="bench", email="", homepage="")
+  user.put()
+  created_on = datetime.datetime.now() - datetime.timedelta(days=NTOPICS)
+  for i in range(NTOPICS):
+    topic = feeds.Topic(forum=forum, subject="Topic %d" % i, created_by="bench", created_on=created_on)
+    topic.put()
+    for j in range(NPOSTS_PER_TOPIC):
+      msg = "Post %d in topic %d, see http://example.com/%d" % (j, i, j)
+      post = feeds.Post(topic=topic, forum=forum, user=user, user_ip=0, message=msg, sha1_digest=feeds.sha.new(msg).hexdigest(), user_name="bench", created_on=created_on)
+      post.put()
+      if 0 == j:
+        topic.first_post = post
+        topic.put()
+      created_on += datetime.timedelta(minutes=1)
+    created_on += datetime.timedelta(days=1)
+  return forum
+
+def bench_feed(name, feed_handler, forum):
+  g_calls.clear()
+  start = time.time()
+  feed_handler.build_feed(forum, feeds_module.forum_root(forum))
+  dur = (time.time() - start) * 1000.0
+  total = sum(g_calls.values())
+  details = ", ".join(["%s: %d" % (call, n) for (call, n) in sorted(g_calls.items())])
+  print("%-7s %3d datastore calls (%s), %.1f ms" % (name, total, details, dur))
+
+feeds_module = None
+def main():
+  global feeds_module
+  sdk = APPENGINE_SDK
+  if len(sys.argv) > 1:
+    sdk = sys.argv[1]
+  if not os.path.exists(sdk):
+    print("App Engine SDK not found at '%s'" % sdk)
+    return
+  setup_sdk(sdk)
+  setup_stubs()
+  sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+  import feeds as feeds_module
+  forum = create_forum(feeds_module)
+  print("%d topics, %d posts" % (NTOPICS, NTOPICS * NPOSTS_PER_TOPIC))
+  bench_feed("rss", feeds_module.RssFeed(), forum)
+  bench_feed("rssall", feeds_module.RssAllFeed(), forum)
+
+if __name__ == "__main__":
+  main()
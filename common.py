@@ -0,0 +1,1117 @@
+# This code is in Public Domain. Take all the code you want, we'll just write more.
+import os, re, Cookie, sha, time, random, urllib, datetime, base64, calendar, array, itertools, zlib, struct
+from email.Utils import formatdate, parsedate_tz, mktime_tz
+from google.appengine.api import users
+from google.appengine.api import memcache
+from google.appengine.ext import webapp
+from google.appengine.ext import db
+from google.appengine.ext.webapp import template
+from django.template import Context, Template, VariableDoesNotExist
+from django.template.defaulttags import ForNode
+from django.template.defaultfilters import striptags
+import logging
+from models import *
+
+# Code shared by all handler modules: request context and cookies,
+# template and forum registries, caching and pagination helpers
+
+# HTTP codes
+HTTP_NOT_ACCEPTABLE = 406
+HTTP_NOT_FOUND = 404
+HTTP_NOT_MODIFIED = 304
+
+FORUMS_MEMCACHED_KEY = "forums"
+
+# how long (in seconds) a process trusts its in-process copy of the forum
+# registry before going back to memcache. Forums change rarely, so other
+# processes picking up an edit within a minute is good enough
+FORUMS_LOCAL_EXPIRE = 60
+MAX_FORUMS = 256 # if you need more, tough
+
+SKINS = ["default"]
+
+# cookie code based on http://code.google.com/p/appengine-utitlies/source/browse/trunk/utilities/session.py
+FOFOU_COOKIE = "fofou-uid"
+COOKIE_EXPIRE_TIME = 60*60*24*120 # valid for 60*60*24*120 seconds => 120 days
+
+def get_user_agent(request): return request.headers.get('User-Agent', '')
+def get_remote_ip(request): return request.remote_addr
+
+def ip2long(ip):
+  ip_array = ip.split('.')
+  ip_long = int(ip_array[0]) * 16777216 + int(ip_array[1]) * 65536 + int(ip_array[2]) * 256 + int(ip_array[3])
+  return ip_long
+
+def long2ip(val):
+  slist = []
+  for x in range(0,4):
+    slist.append(str(int(val >> (24 - (x * 8)) & 0xFF)))
+  return ".".join(slist)
+
+def to_unicode(val):
+  if isinstance(val, unicode): return val
+  try:
+    return unicode(val, 'latin-1')
+  except:
+    pass
+  try:
+    return unicode(val, 'ascii')
+  except:
+    pass
+  try:
+    return unicode(val, 'utf-8')
+  except:
+    raise
+
+
+def req_get_vals(req, names, strip=True): 
+  if strip:
+    return [req.get(name).strip() for name in names]
+  else:
+    return [req.get(name) for name in names]
+  
+def get_inbound_cookie(request):
+  c = Cookie.SimpleCookie()
+  cstr = request.headers.get('Cookie', '')
+  c.load(cstr)
+  return c
+
+def new_user_id():
+  # random part makes ids unique for requests handled at the same time
+  sid = sha.new(repr(time.time()) + repr(random.random())).hexdigest()
+  return sid
+
+def valid_user_cookie(c):
+  # cookie should always be a hex-encoded sha1 checksum
+  if len(c) != 40:
+    return False
+  # TODO: check that user with that cookie exists, the way appengine-utilities does
+  return True
+
+# Per-request state. A process can handle many requests, also concurrently,
+# so nothing specific to a request can be kept in module globals
+class RequestContext(object):
+  def __init__(self, request, response):
+    self.request = request
+    self.response = response
+    # users.get_current_user() and users.is_current_user_admin() read
+    # process-wide os.environ, so the user is taken from the request's
+    # environment instead. None if not logged in
+    self.user = None
+    email = request.environ.get('USER_EMAIL')
+    if email:
+      self.user = users.User(email, _auth_domain=request.environ.get('AUTH_DOMAIN', 'gmail.com'))
+    self.is_admin = self.user is not None and request.environ.get('USER_IS_ADMIN') == '1'
+    # FOFOU_COOKIE morsel, see get_fofou_cookie(). fofou_cookie_is_new is
+    # True if the browser didn't send one and it was just created
+    self.fofou_cookie = None
+    self.fofou_cookie_is_new = False
+    self.fofou_cookie_sent = False
+
+# Base class for all handlers, sets up RequestContext as self.ctx
+class FofouHandler(webapp.RequestHandler):
+  def initialize(self, request, response):
+    webapp.RequestHandler.initialize(self, request, response)
+    self.ctx = RequestContext(request, response)
+
+# returns either a FOFOU_COOKIE sent by the browser or a newly created cookie
+def get_fofou_cookie(ctx):
+  if ctx.fofou_cookie:
+    return ctx.fofou_cookie
+  cookies = get_inbound_cookie(ctx.request)
+  for cookieName in cookies.keys():
+    if FOFOU_COOKIE != cookieName:
+      del cookies[cookieName]
+  if (FOFOU_COOKIE not in cookies) or not valid_user_cookie(cookies[FOFOU_COOKIE].value):
+    cookies[FOFOU_COOKIE] = new_user_id()
+    cookies[FOFOU_COOKIE]['path'] = '/'
+    cookies[FOFOU_COOKIE]['expires'] = COOKIE_EXPIRE_TIME
+    ctx.fofou_cookie_is_new = True
+  ctx.fofou_cookie = cookies[FOFOU_COOKIE]
+  return ctx.fofou_cookie
+
+def get_fofou_cookie_val(ctx):
+  c = get_fofou_cookie(ctx)
+  return c.value
+
+# sets FOFOU_COOKIE in the response
+def send_fofou_cookie(ctx):
+  if ctx.fofou_cookie_sent:
+    return
+  # a hack extract the cookie part from the whole "Set-Cookie: val" header
+  c = str(get_fofou_cookie(ctx))
+  c = c.split(": ", 1)[1]
+  ctx.response.headers["Set-Cookie"] = c
+  ctx.fofou_cookie_sent = True
+
+g_anonUser = None
+def anonUser():
+  global g_anonUser
+  if None == g_anonUser:
+    g_anonUser = users.User("dummy@dummy.address.com")
+  return g_anonUser
+
+# Templates are parsed on first use: webapp's template.load() keeps parsed
+# templates in its own per-process cache, snippets used to format feed items
+# are compiled from strings and kept in g_snippets
+FEED_ITEM_TEMPLATE = "feed_item"
+FEED_SNIPPETS = {
+  FEED_ITEM_TEMPLATE : "{% if name %}<strong>{{ name }}</strong>: {% endif %}{{ msg }}",
+}
+g_snippets = {}
+
+# template_name is a path (e.g. "skins/default/topic.html") or name of a
+# feed snippet
+def get_template(template_name):
+  if template_name not in FEED_SNIPPETS:
+    return template.load(template_name)
+  t = g_snippets.get(template_name)
+  if t is None:
+    # setdefault() so that requests compiling it at the same time end up
+    # using the same one
+    t = g_snippets.setdefault(template_name, Template(FEED_SNIPPETS[template_name]))
+  return t
+
+def template_render(template_name, template_values):
+  return get_template(template_name).render(Context(template_values))
+
+def html_out(response, html):
+  response.headers['Content-Type'] = 'text/html'
+  response.out.write(html)
+
+# writes a cached page, with log in/out links spliced in. deflated_parts
+# are deflate_parts(html), or empty if there's no gzip version
+def cached_html_out(request, response, html, deflated_parts, log_in_out, etag=None, last_modified=None):
+  response.headers['Content-Type'] = 'text/html'
+  gzip_fn = None
+  if deflated_parts:
+    gzip_fn = lambda: gzip_spliced(html, deflated_parts, log_in_out)
+  compressed_out(request, response, splice_log_in_out(html, log_in_out), gzip_fn, etag, last_modified)
+
+# Streaming rendering. Instead of rendering the whole page before sending
+# anything, the part of the page before a top-level {% for %} loop (e.g.
+# header and sidebar before posts in topic.html) is sent as soon as it's
+# rendered and the loop is sent STREAM_LOOP_CHUNK iterations at a time.
+# Loops nested in other tags are rendered as a whole. The part before the
+# first loop is rendered by the handler, so errors in it still give a 500;
+# an error later on can only cut the page short. It only helps if the WSGI
+# server sends data as it's written, App Engine (and its development
+# server) buffers the response, so it's off there
+ON_APP_ENGINE = os.environ.get('SERVER_SOFTWARE', '').startswith(('Google App Engine', 'Development'))
+STREAM_RESPONSES = not ON_APP_ENGINE
+STREAM_LOOP_CHUNK = 10
+
+# same as ForNode.render(), but yields output in chunks
+def iter_render_for_node(node, context):
+  parentloop = {}
+  if context.has_key('forloop'):
+    parentloop = context['forloop']
+  context.push()
+  try:
+    try:
+      values = node.sequence.resolve(context, True)
+    except VariableDoesNotExist:
+      values = []
+    if values is None:
+      values = []
+    if not hasattr(values, '__len__'):
+      values = list(values)
+    len_values = len(values)
+    if node.reversed:
+      values = reversed(values)
+    bits = []
+    for (i, item) in enumerate(values):
+      context['forloop'] = {
+        'counter0' : i,
+        'counter' : i + 1,
+        'revcounter' : len_values - i,
+        'revcounter0' : len_values - i - 1,
+        'first' : (i == 0),
+        'last' : (i == len_values - 1),
+        'parentloop' : parentloop,
+      }
+      context[node.loopvar] = item
+      for n in node.nodelist_loop:
+        bits.append(n.render(context))
+      if 0 == (i + 1) % STREAM_LOOP_CHUNK:
+        yield "".join(bits)
+        bits = []
+    if bits:
+      yield "".join(bits)
+  finally:
+    context.pop()
+
+def iter_render_template(template_name, template_values):
+  context = Context(template_values)
+  bits = []
+  for node in get_template(template_name).nodelist:
+    # loopvar is how django 0.96 ForNode is laid out, other versions are
+    # rendered as any other node
+    if isinstance(node, ForNode) and hasattr(node, 'loopvar'):
+      yield "".join(bits)
+      bits = []
+      for chunk in iter_render_for_node(node, context):
+        yield chunk
+    else:
+      bits.append(node.render(context))
+  yield "".join(bits)
+
+# Response that can send its body from an iterator (set as stream) as
+# it's being rendered. Anything written to out before is sent first
+class StreamingResponse(webapp.Response):
+  def __init__(self):
+    webapp.Response.__init__(self)
+    self.stream = None
+
+  def wsgi_write(self, start_response):
+    if self.stream is None:
+      return webapp.Response.wsgi_write(self, start_response)
+    status = "%d %s" % (self.status(), self.status_message())
+    write = start_response(status, self.headers.items())
+    chunks = [self.out.getvalue()]
+    try:
+      try:
+        for chunk in itertools.chain(chunks, self.stream):
+          if isinstance(chunk, unicode):
+            chunk = chunk.encode('utf-8')
+          if chunk:
+            write(chunk)
+      except:
+        # status and headers are already sent, all we can do is stop
+        logging.exception("error while streaming response")
+    finally:
+      self.out.close()
+
+  def clear(self):
+    webapp.Response.clear(self)
+    self.stream = None
+
+# WSGIApplication that gives handlers a StreamingResponse
+class FofouApplication(webapp.WSGIApplication):
+  RESPONSE_CLASS = StreamingResponse
+
+# pages that are cached need to be rendered as a whole, they are rendered
+# with template_render() or with buffered=True
+def template_out(response, template_name, template_values, buffered=False):
+  if STREAM_RESPONSES and not buffered and isinstance(response, StreamingResponse):
+    response.headers['Content-Type'] = 'text/html'
+    stream = iter_render_template(template_name, template_values)
+    response.stream = itertools.chain([stream.next()], stream)
+  else:
+    html_out(response, template_render(template_name, template_values))
+
+# Pages cached for all users are rendered with this placeholder in place of
+# log_in_out and the real value is spliced in after cache lookup
+LOG_IN_OUT_PLACEHOLDER = "<!--fofou:log_in_out-->"
+
+def splice_log_in_out(html, log_in_out):
+  if isinstance(html, str) and isinstance(log_in_out, unicode):
+    log_in_out = log_in_out.encode('utf-8')
+  return html.replace(LOG_IN_OUT_PLACEHOLDER, log_in_out)
+
+# Precompressed responses. Cached feeds and pages are stored along with
+# their gzip version, so serving compressed responses costs no compression
+# per request. Pages with log in/out links spliced in are stored as raw
+# deflate parts split at LOG_IN_OUT_PLACEHOLDER; per request only log in/out
+# links are compressed and the parts are joined into a gzip stream, which
+# just needs a crc32 of the page. App Engine doesn't let apps set
+# Content-Encoding (it compresses responses itself), so it's only done
+# under other WSGI servers
+GZIP_RESPONSES = not ON_APP_ENGINE
+GZIP_LEVEL = 6
+# gzip member header: deflate, no flags, no mtime, unknown OS
+GZIP_HEADER = "\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+
+def gzip_trailer(crc, size):
+  return struct.pack("<LL", crc & 0xffffffffL, size & 0xffffffffL)
+
+# compresses data as a part of a raw deflate stream. Parts that aren't last
+# end with a full flush, so they can be concatenated with other parts
+def deflate_part(data, last):
+  c = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+  if last:
+    return c.compress(data) + c.flush(zlib.Z_FINISH)
+  return c.compress(data) + c.flush(zlib.Z_FULL_FLUSH)
+
+def gzip_compress(data):
+  if isinstance(data, unicode):
+    data = data.encode('utf-8')
+  return GZIP_HEADER + deflate_part(data, True) + gzip_trailer(zlib.crc32(data), len(data))
+
+# returns gzip version of data to be cached with it, or None if compressed
+# responses aren't served
+def gzip_variant(data):
+  if not GZIP_RESPONSES:
+    return None
+  return gzip_compress(data)
+
+# returns deflated parts of html, for gzip_spliced(), or None if compressed
+# responses aren't served
+def deflate_parts(html):
+  if not GZIP_RESPONSES:
+    return None
+  parts = html.split(LOG_IN_OUT_PLACEHOLDER)
+  return [deflate_part(part, i == len(parts) - 1) for (i, part) in enumerate(parts)]
+
+# returns gzip version of splice_log_in_out(html, log_in_out), given
+# deflate_parts(html)
+def gzip_spliced(html, deflated_parts, log_in_out):
+  if isinstance(log_in_out, unicode):
+    log_in_out = log_in_out.encode('utf-8')
+  deflated_log_in_out = deflate_part(log_in_out, False)
+  out = [GZIP_HEADER]
+  crc = 0
+  size = 0
+  for (i, part) in enumerate(html.split(LOG_IN_OUT_PLACEHOLDER)):
+    if i > 0:
+      out.append(deflated_log_in_out)
+      crc = zlib.crc32(log_in_out, crc)
+      size += len(log_in_out)
+    out.append(deflated_parts[i])
+    crc = zlib.crc32(part, crc)
+    size += len(part)
+  out.append(gzip_trailer(crc, size))
+  return "".join(out)
+
+def accepts_gzip(request):
+  for coding in request.headers.get('Accept-Encoding', '').split(","):
+    params = coding.split(";")
+    if params[0].strip().lower() not in ("gzip", "x-gzip"):
+      continue
+    for param in params[1:]:
+      (name, sep, value) = param.partition("=")
+      if name.strip().lower() == "q":
+        try:
+          return float(value) > 0
+        except ValueError:
+          return False
+    return True
+  return False
+
+def add_vary(response, header):
+  vary = response.headers.get('Vary')
+  if not vary:
+    response.headers['Vary'] = header
+  elif header.lower() not in [h.strip().lower() for h in vary.split(",")]:
+    response.headers['Vary'] = vary + ", " + header
+
+# Writes a cached response body or, if client accepts it, its gzip version
+# returned by gzip_fn (None if there's no gzip version). If etag is given,
+# returns 304 if client's copy is up to date. gzip version has a different
+# etag, since it's a different entity
+def compressed_out(request, response, body, gzip_fn, etag=None, last_modified=None):
+  use_gzip = False
+  if GZIP_RESPONSES:
+    add_vary(response, 'Accept-Encoding')
+    use_gzip = gzip_fn is not None and accepts_gzip(request)
+  if use_gzip and etag:
+    etag = etag[:-1] + '-gzip"'
+  if etag and not_modified(request, response, etag, last_modified):
+    return
+  if use_gzip:
+    response.headers['Content-Encoding'] = 'gzip'
+    body = gzip_fn()
+  response.out.write(body)
+
+def valid_forum_url(url):
+  if not url:
+    return False
+  return url == urllib.quote_plus(url)
+
+# very simplistic check for <txt> being a valid e-mail address
+def valid_email(txt):
+  # allow empty strings
+  if not txt:
+    return True
+  if '@' not in txt:
+    return False
+  if '.' not in txt:
+    return False
+  return True
+
+def forumurl_from_url(url):
+  assert '/' == url[0]
+  path = url[1:]
+  if '/' in path:
+    (forumurl, rest) = path.split("/", 1)
+  else:
+    forumurl = path
+  return forumurl
+
+def forum_root(forum): return "/" + forum.url + "/"
+
+def forum_tmpldir(forum):
+  skin_name = forum.skin
+  if skin_name not in SKINS:
+    skin_name = SKINS[0]
+  return os.path.join("skins", skin_name)
+
+# Forum registry. Every request needs to resolve the forum from the url and
+# forums change a few times a year, so instead of querying the datastore on
+# every request we keep all forums in memcache and a resolved
+# url -> (forum, siteroot, tmpldir) dictionary in-process.
+# The registry is a tuple (forums, forums_by_url)
+g_forums = None
+g_forums_expire = 0
+
+def load_forums():
+  forums = memcache.get(FORUMS_MEMCACHED_KEY)
+  if forums is None:
+    forums = db.GqlQuery("SELECT * FROM Forum").fetch(MAX_FORUMS)
+    memcache.set(FORUMS_MEMCACHED_KEY, forums)
+  forums_by_url = {}
+  for forum in forums:
+    forums_by_url[forum.url] = (forum, forum_root(forum), forum_tmpldir(forum))
+  return (forums, forums_by_url)
+
+def get_forum_registry():
+  global g_forums, g_forums_expire
+  now = time.time()
+  if g_forums is None or now > g_forums_expire:
+    g_forums = load_forums()
+    g_forums_expire = now + FORUMS_LOCAL_EXPIRE
+  return g_forums
+
+# must be called after any change to Forum entities
+def invalidate_forums():
+  global g_forums
+  memcache.delete(FORUMS_MEMCACHED_KEY)
+  g_forums = None
+
+# returns a list of all forums. Forum objects are shared with other requests
+# so must not be modified
+def get_forums():
+  (forums, forums_by_url) = get_forum_registry()
+  return forums
+
+def forum_from_url(url):
+  (forum, siteroot, tmpldir) = forum_siteroot_tmpldir_from_url(url)
+  return forum
+
+def forum_siteroot_tmpldir_from_url(url):
+  forumurl = forumurl_from_url(url)
+  (forums, forums_by_url) = get_forum_registry()
+  return forums_by_url.get(forumurl, (None, None, None))
+
+def get_log_in_out(ctx, url):
+  user = ctx.user
+  if user:
+    if ctx.is_admin:
+      return "Welcome admin, %s! <a href=\"%s\">Log out</a>" % (user.nickname(), users.create_logout_url(url))
+    else:
+      return "Welcome, %s! <a href=\"%s\">Log out</a>" % (user.nickname(), users.create_logout_url(url))
+  else:
+    return "<a href=\"%s\">Log in or register</a>" % users.create_login_url(url)    
+
+# Per-forum cache generations. Data cached for a forum is stored under
+# memcache keys that include the forum's generation number for that kind of
+# data, so invalidating it is just bumping the number. Entries for old
+# generations are never read again and get evicted by memcache.
+def cache_gen_key(what, forum):
+  return "gen:%s:%s" % (what, str(forum.key()))
+
+def get_cache_gen(what, forum):
+  key = cache_gen_key(what, forum)
+  gen = memcache.get(key)
+  if gen is None:
+    # start from current time (in ms) so that if the counter is evicted we
+    # don't go back to a generation that might still have data cached
+    gen = int(time.time() * 1000)
+    if not memcache.add(key, gen):
+      gen = memcache.get(key) or gen
+  return gen
+
+# same as get_cache_gen() for many forums, with one memcache call if the
+# generations are cached
+def get_cache_gens(what, forums):
+  keys = [cache_gen_key(what, forum) for forum in forums]
+  gens = memcache.get_multi(keys)
+  res = []
+  for (key, forum) in zip(keys, forums):
+    gen = gens.get(key)
+    if gen is None:
+      gen = get_cache_gen(what, forum)
+    res.append(gen)
+  return res
+
+def bump_cache_gen(what, forum):
+  key = cache_gen_key(what, forum)
+  if memcache.incr(key) is None:
+    memcache.set(key, int(time.time() * 1000))
+
+def feed_memcached_key(feed_type, forum, gen=None):
+  if gen is None:
+    gen = get_cache_gen("feed", forum)
+  return "feed:%s:%s:%d" % (feed_type, str(forum.key()), gen)
+
+# must be called after any change to posts or topics of a given forum
+def invalidate_feeds(forum):
+  bump_cache_gen("feed", forum)
+
+# rendered topic list pages are cached per forum, page and viewer class
+# (moderators see deleted topics)
+def topic_list_memcached_key(forum, is_moderator, after, start_from):
+  viewer = "anon"
+  if is_moderator:
+    viewer = "moderator"
+  gen = get_cache_gen("topiclist", forum)
+  return "topiclist:%s:%d:%s:%s:%s" % (str(forum.key()), gen, viewer, after, start_from)
+
+# must be called after any change to topics of a given forum
+def invalidate_topic_list(forum):
+  bump_cache_gen("topiclist", forum)
+
+def digest_key_name(forum, sha1_digest):
+  return "%s:%s" % (str(forum.key()), sha1_digest)
+
+# Bloom filter of message digests posted in a forum. It answers "definitely
+# not a duplicate" for most new posts without a datastore round-trip.
+# The filter is split into BLOOM_SEGMENTS segments kept in memcache and all
+# bits of a digest are in one segment, chosen by its first byte, so a check
+# reads a single small segment and a post updates it with compare-and-set.
+# There's no local copy that could be stale. The filter is built by
+# "digests" maintenance job and a segment is only used if it belongs to the
+# last complete build; if it's evicted from memcache or an update fails we
+# go back to checking its digests in the datastore until the job is run
+# again. With 2^20 bits and 7 hashes false positive rate is ~1% for 100k
+# messages
+BLOOM_SEGMENTS = 256
+BLOOM_SEGMENT_BITS = 4096
+BLOOM_HASHES = 7
+BLOOM_CAS_RETRIES = 5
+
+class DigestBloomSegment(object):
+  def __init__(self, build_id, data=None):
+    self.build_id = build_id
+    if data:
+      self.bits = array.array('B', data)
+    else:
+      self.bits = array.array('B', [0]) * (BLOOM_SEGMENT_BITS / 8)
+
+  # sha1 digest is already uniformly distributed, so we use consecutive
+  # 12-bit chunks of it, after the segment byte, as bit positions
+  def positions(self, sha1_digest):
+    return [int(sha1_digest[2+i*3:5+i*3], 16) for i in range(BLOOM_HASHES)]
+
+  def add(self, sha1_digest):
+    for pos in self.positions(sha1_digest):
+      self.bits[pos >> 3] |= 1 << (pos & 7)
+
+  def __contains__(self, sha1_digest):
+    for pos in self.positions(sha1_digest):
+      if not self.bits[pos >> 3] & (1 << (pos & 7)):
+        return False
+    return True
+
+  def serialize(self):
+    return (self.build_id, self.bits.tostring())
+
+def bloom_segment_no(sha1_digest):
+  return int(sha1_digest[:2], 16) % BLOOM_SEGMENTS
+
+def bloom_memcached_key(forum, segment_no):
+  return "digestbloom:%s:%d" % (str(forum.key()), segment_no)
+
+# id of the last complete build of the filter is kept under this key
+def bloom_complete_memcached_key(forum):
+  return "digestbloom:%s:complete" % str(forum.key())
+
+def deserialize_bloom_segment(data):
+  if data is None:
+    return None
+  (build_id, bits) = data
+  return DigestBloomSegment(build_id, bits)
+
+# starts a new build of the filter: all segments are reset and the filter
+# isn't used until finish_digest_bloom()
+def start_digest_bloom(forum):
+  build_id = new_user_id()
+  memcache.delete(bloom_complete_memcached_key(forum))
+  segments = {}
+  for segment_no in range(BLOOM_SEGMENTS):
+    segments[bloom_memcached_key(forum, segment_no)] = DigestBloomSegment(build_id).serialize()
+  memcache.set_multi(segments)
+  return build_id
+
+# marks a build as complete. Returns False if any segment was evicted during
+# the build, in which case the job needs to be re-run
+def finish_digest_bloom(forum):
+  keys = [bloom_memcached_key(forum, segment_no) for segment_no in range(BLOOM_SEGMENTS)]
+  segments = memcache.get_multi(keys)
+  build_ids = set([build_id for (build_id, bits) in segments.values()])
+  if len(segments) != BLOOM_SEGMENTS or len(build_ids) != 1:
+    return False
+  memcache.set(bloom_complete_memcached_key(forum), build_ids.pop())
+  return True
+
+# adds digests to segments of the filter that exist (i.e. built or being
+# built), with compare-and-set so that concurrent updates don't lose bits
+def add_to_digest_bloom(forum, digests):
+  by_segment = {}
+  for d in digests:
+    by_segment.setdefault(bloom_segment_no(d), []).append(d)
+  client = memcache.Client()
+  for (segment_no, segment_digests) in by_segment.items():
+    key = bloom_memcached_key(forum, segment_no)
+    for i in range(BLOOM_CAS_RETRIES):
+      segment = deserialize_bloom_segment(client.gets(key))
+      if segment is None:
+        break
+      for d in segment_digests:
+        segment.add(d)
+      if client.cas(key, segment.serialize()):
+        break
+    else:
+      # a segment that misses digests must not be used
+      logging.info("couldn't update digest bloom segment %s" % key)
+      memcache.delete(key)
+
+# returns PostDigest if a message with this digest has already been posted
+# in this forum
+def find_duplicate(forum, sha1_digest):
+  complete_key = bloom_complete_memcached_key(forum)
+  segment_key = bloom_memcached_key(forum, bloom_segment_no(sha1_digest))
+  cached = memcache.get_multi([complete_key, segment_key])
+  segment = deserialize_bloom_segment(cached.get(segment_key))
+  if segment and segment.build_id == cached.get(complete_key) and sha1_digest not in segment:
+    return None
+  return PostDigest.get_by_key_name(digest_key_name(forum, sha1_digest))
+
+# saves PostDigest for a new post, unless a message with this digest has
+# already been posted (e.g. by a concurrent request), in which case the
+# existing one is kept. Returns PostDigest
+def save_post_digest(forum, post):
+  user_key = Post.user.get_value_for_datastore(post)
+  return PostDigest.get_or_insert(digest_key_name(forum, post.sha1_digest), forum=forum, post=post, user=user_key, user_ip=post.user_ip, created_on=post.created_on)
+
+# creates PostDigest entities for posts, unless there already is one for
+# an earlier post with the same message. Returns entities to save
+def make_post_digests(forum, posts):
+  key_names = [digest_key_name(forum, post.sha1_digest) for post in posts]
+  existing = dict(zip(key_names, PostDigest.get_by_key_name(key_names)))
+  res = {}
+  for (key_name, post) in zip(key_names, posts):
+    digest = res.get(key_name) or existing[key_name]
+    if digest and digest.created_on <= post.created_on:
+      continue
+    user_key = Post.user.get_value_for_datastore(post)
+    res[key_name] = PostDigest(key_name=key_name, forum=forum, post=post, user=user_key, user_ip=post.user_ip, created_on=post.created_on)
+  return res.values()
+
+# runs update_fn(topic) in a transaction and saves the topic. Returns
+# updated topic
+def update_topic(topic_key, update_fn):
+  def txn():
+    topic = db.get(topic_key)
+    update_fn(topic)
+    topic.put()
+    return topic
+  return db.run_in_transaction(txn)
+
+def counter_key_names(forum, name):
+  return ["%s:%s:%d" % (str(forum.key()), name, shard) for shard in range(COUNTER_SHARDS)]
+
+def counter_memcached_key(forum, name):
+  return "counter:%s:%s" % (str(forum.key()), name)
+
+def incr_forum_counter(forum, name, delta):
+  if 0 == delta:
+    return
+  key_name = random.choice(counter_key_names(forum, name))
+  def txn():
+    counter = ForumCounter.get_by_key_name(key_name)
+    if not counter:
+      counter = ForumCounter(key_name=key_name, forum=forum, name=name)
+    counter.count += delta
+    counter.put()
+  db.run_in_transaction(txn)
+  memcache.delete(counter_memcached_key(forum, name))
+
+# sets all shards of a counter so that their sum is <value>
+def set_forum_counter(forum, name, value):
+  counters = []
+  for key_name in counter_key_names(forum, name):
+    counters.append(ForumCounter(key_name=key_name, forum=forum, name=name, count=value))
+    value = 0
+  db.put(counters)
+  memcache.delete(counter_memcached_key(forum, name))
+
+def get_forum_counter(forum, name):
+  key = counter_memcached_key(forum, name)
+  count = memcache.get(key)
+  if count is None:
+    counters = ForumCounter.get_by_key_name(counter_key_names(forum, name))
+    count = sum([c.count for c in counters if c])
+    memcache.set(key, count)
+  return count
+
+# Search index. Every topic has a TopicIndex with distinct words of its
+# subject and posts in a list property. Searching for several words is
+# a query with an equality filter for each word, which the datastore answers
+# by merge-joining its built-in indexes, so no composite indexes are needed
+# and a query reads only matching topics, however big the forum gets.
+# Indexes are updated as posts are added and (un)deleted; topics posted
+# before the index existed are added by "search" maintenance job
+SEARCH_MIN_WORD_LEN = 2
+SEARCH_MAX_WORD_LEN = 40
+SEARCH_STOP_WORDS = set(["the", "and", "for", "are", "but", "not", "you",
+  "all", "any", "can", "was", "one", "our", "has", "have", "this", "that",
+  "with", "from", "they", "will", "what", "there", "their", "which", "would",
+  "about", "into", "than", "then", "them", "these", "its", "is", "it",
+  "in", "on", "of", "to", "be", "an", "as", "at", "by", "or", "if", "so",
+  "do", "no", "we", "he", "me", "my"])
+# max number of posts of a topic read when re-indexing it
+SEARCH_MAX_POSTS = 1000
+
+g_word_re = re.compile(r"\w+", re.UNICODE)
+
+# returns a list of words in text, lowercased and with stop words removed
+def search_words(text):
+  res = []
+  for w in g_word_re.findall(striptags(text).lower()):
+    if len(w) >= SEARCH_MIN_WORD_LEN and w not in SEARCH_STOP_WORDS:
+      res.append(w[:SEARCH_MAX_WORD_LEN])
+  return res
+
+def topic_index_key_name(topic_id):
+  return "t%d" % topic_id
+
+# adds delta to counts of words
+def count_words(counts, words, delta):
+  for w in words:
+    n = counts.get(w, 0) + delta
+    if n > 0:
+      counts[w] = n
+    elif w in counts:
+      del counts[w]
+
+# creates TopicIndex from topic's posts (deleted posts are skipped).
+# Returns the entity to save
+def make_topic_index(topic, posts):
+  counts = {}
+  for post in posts:
+    if not post.is_deleted:
+      count_words(counts, search_words(post.message), 1)
+  forum_key = Topic.forum.get_value_for_datastore(topic)
+  index = TopicIndex(key_name=topic_index_key_name(topic.key().id()), forum=forum_key, topic=topic)
+  index.set_counts(counts, search_words(topic.subject))
+  index.last_post_on = topic.last_post_on or topic.created_on
+  return index
+
+# adds (delta is 1) or removes (delta is -1) words of a post to/from the
+# index of its topic. topic must have last post already updated
+def update_topic_index(topic, post, delta):
+  key_name = topic_index_key_name(topic.key().id())
+  words = search_words(post.message)
+  subject_words = search_words(topic.subject)
+  forum_key = Topic.forum.get_value_for_datastore(topic)
+  def txn():
+    index = TopicIndex.get_by_key_name(key_name)
+    if not index:
+      index = TopicIndex(key_name=key_name, forum=forum_key, topic=topic)
+    counts = index.get_counts()
+    count_words(counts, words, delta)
+    index.set_counts(counts, subject_words)
+    index.last_post_on = topic.last_post_on or topic.created_on
+    index.put()
+  db.run_in_transaction(txn)
+
+def reindex_topic(topic):
+  posts = Post.gql("WHERE topic = :1 AND is_deleted = False", topic).fetch(SEARCH_MAX_POSTS)
+  make_topic_index(topic, posts).put()
+
+def delete_topic_index(topic):
+  db.delete(db.Key.from_path('TopicIndex', topic_index_key_name(topic.key().id())))
+
+def http_date(timestamp):
+  return formatdate(timestamp, usegmt=True)
+
+# Sets ETag and Last-Modified headers in the response and checks them against
+# If-None-Match/If-Modified-Since sent by the client. Returns True (and sets
+# 304 status) if client's copy is up-to-date and we don't need to send the body
+def not_modified(request, response, etag, last_modified):
+  response.headers['ETag'] = etag
+  response.headers['Last-Modified'] = http_date(last_modified)
+  if_none_match = request.headers.get('If-None-Match')
+  if if_none_match:
+    etags = [t.strip() for t in if_none_match.split(",")]
+    if etag not in etags and "*" not in etags:
+      return False
+  else:
+    if_modified_since = request.headers.get('If-Modified-Since')
+    if not if_modified_since:
+      return False
+    t = parsedate_tz(if_modified_since)
+    if not t or mktime_tz(t) < int(last_modified):
+      return False
+  response.set_status(HTTP_NOT_MODIFIED)
+  return True
+
+# Keyset pagination. Instead of fetch(limit, offset), which makes the
+# datastore read and discard <offset> entities, a page starts with a filter
+# on created_on of the last entity shown on the previous page. Entities
+# with the same created_on are returned in key order (the datastore breaks
+# ties by key), so remaining ties are read with a separate query on key.
+
+def datetime_to_usec(dt):
+  return calendar.timegm(dt.utctimetuple()) * 1000000 + dt.microsecond
+
+def usec_to_datetime(usec):
+  dt = datetime.datetime.utcfromtimestamp(usec / 1000000)
+  return dt.replace(microsecond = usec % 1000000)
+
+# a page token is an opaque string encoding created_on and id of the last
+# entity on a page and the number of entities shown so far (for display
+# only, -1 if not known)
+def encode_page_token(entity, offset):
+  return encode_page_position(entity.created_on, entity.key().id(), offset)
+
+def encode_page_position(created_on, last_id, offset):
+  s = "%d.%d.%d" % (datetime_to_usec(created_on), last_id, offset)
+  return base64.urlsafe_b64encode(s).rstrip("=")
+
+# returns token of the page that follows a page of entities starting after
+# <after> (as returned by decode_page_token())
+def next_page_token(entities, after):
+  offset = len(entities)
+  if after:
+    offset = -1
+    if after[2] >= 0:
+      offset = after[2] + len(entities)
+  return encode_page_token(entities[-1], offset)
+
+# returns (created_on, id, offset) or None if token is not valid
+def decode_page_token(token):
+  try:
+    s = base64.urlsafe_b64decode(str(token) + "=" * (-len(token) % 4))
+    (usec, last_id, offset) = [int(v) for v in s.split(".")]
+    return (usec_to_datetime(usec), last_id, offset)
+  except (TypeError, ValueError, UnicodeError):
+    return None
+
+# runs "<where> ORDER BY created_on" query on a model, returning up to <limit>
+# entities after position <after> (as returned by decode_page_token()).
+# Returns (entities, has_more)
+def keyset_fetch(model, where, args, descending, after, limit):
+  order = "ORDER BY created_on"
+  if descending:
+    order += " DESC"
+  if not after:
+    entities = model.gql(where + " " + order, *args).fetch(limit + 1)
+    return (entities[:limit], len(entities) > limit)
+  (created_on, last_id, offset) = after
+  args = list(args) + [created_on]
+  # entities with the same created_on as the last one shown, after it
+  ties_where = "%s AND created_on = :%d" % (where, len(args))
+  ties_args = args[:]
+  if last_id > 0:
+    ties_args.append(db.Key.from_path(model.kind(), last_id))
+    ties_where += " AND __key__ > :%d" % len(ties_args)
+  entities = model.gql(ties_where + " ORDER BY __key__", *ties_args).fetch(limit + 1)
+  if len(entities) <= limit:
+    op = ">"
+    if descending:
+      op = "<"
+    rest_where = "%s AND created_on %s :%d" % (where, op, len(args))
+    entities += model.gql(rest_where + " " + order, *args).fetch(limit + 1 - len(entities))
+  return (entities[:limit], len(entities) > limit)
+
+# Topics and posts as shown by topic list and topic pages (and the JSON api)
+TOPICS_PER_PAGE = 75
+POSTS_PER_PAGE = 50
+# topics older than that are archived i.e. can't be replied to
+ARCHIVE_AFTER = datetime.timedelta(days=7)
+
+# returns (topics, has_more) for a page of topic list starting after
+# <after> (as returned by decode_page_token()). Moderators also see
+# deleted topics
+def get_topics_page(forum, is_moderator, after):
+  if is_moderator:
+    return keyset_fetch(Topic, "WHERE forum = :1", [forum], True, after, TOPICS_PER_PAGE)
+  return keyset_fetch(Topic, "WHERE forum = :1 AND is_deleted = False", [forum], True, after, TOPICS_PER_PAGE)
+
+def topic_posts_where(is_moderator):
+  if is_moderator:
+    return "WHERE forum = :1 AND topic = :2"
+  return "WHERE forum = :1 AND topic = :2 AND is_deleted = False"
+
+# returns (posts, has_more) for a page of topic's posts (oldest first)
+# starting after <after> (as returned by decode_page_token()). Moderators
+# also see deleted posts
+def get_topic_posts(forum, topic, is_moderator, after=None):
+  return keyset_fetch(Post, topic_posts_where(is_moderator), [forum, topic], False, after, POSTS_PER_PAGE)
+
+# returns token of a topic page that shows a post, None for the first page.
+# Finding the post's position would mean counting posts before it, so
+# other posts are shown on a page starting at the post itself
+def topic_page_token_of_post(forum, topic, post, is_moderator):
+  (posts, has_more) = get_topic_posts(forum, topic, is_moderator)
+  if post.key() in [p.key() for p in posts]:
+    return None
+  return encode_page_position(post.created_on, post.key().id() - 1, -1)
+
+def is_topic_archived(topic):
+  return datetime.datetime.now() > topic.created_on + ARCHIVE_AFTER
+
+# ETag of data derived from a topic and its posts. Any new or (un)deleted
+# post updates the topic (and its updated_on), extra is for whatever else
+# the data depends on
+def topic_etag(topic, extra=""):
+  s = "%d:%d:%d:%d:%d:%s" % (topic.key().id(), datetime_to_usec(topic.updated_on), topic.ncomments, topic.is_deleted, MESSAGE_RENDERER_VERSION, extra)
+  return '"%s"' % sha.new(s.encode('utf-8')).hexdigest()
+
+# hash of forum settings shown on its pages, so that ETags of pages change
+# when the forum is edited
+def forum_fingerprint(forum):
+  vals = [forum.url, forum.title, forum.tagline, forum.sidebar, forum.skin, forum.analytics_code]
+  s = u"\0".join([unicode(v or "") for v in vals])
+  return sha.new(s.encode('utf-8')).hexdigest()
+
+# Snapshots of archived topic pages (see TopicSnapshot). They are cached in
+# memcache (False if there's no snapshot) and deleted when a post in the
+# topic is (un)deleted or added. A snapshot is also out of date when the
+# forum is edited, posts are re-rendered or a new version of the app (with
+# possibly changed templates) is deployed, which snapshot_fingerprint()
+# captures. Snapshots are keyed by page number and only made for pages
+# reached from the previous page's snapshot (see topic_snapshot_page_no()),
+# so made up page tokens can't create any number of them
+def topic_snapshot_key_name(topic_id, skin, is_moderator, page_no):
+  viewer = "anon"
+  if is_moderator:
+    viewer = "moderator"
+  return "%d:%s:%s:%d" % (topic_id, skin, viewer, page_no)
+
+# returns number of the topic page starting after <after> (as returned by
+# decode_page_token()), or None if it doesn't start at a page boundary
+def topic_snapshot_page_no(after):
+  if not after:
+    return 0
+  offset = after[2]
+  if offset <= 0 or offset % POSTS_PER_PAGE != 0:
+    return None
+  return offset / POSTS_PER_PAGE
+
+def snapshot_fingerprint(forum):
+  s = "%s:%d:%s" % (forum_fingerprint(forum), MESSAGE_RENDERER_VERSION, os.environ.get("CURRENT_VERSION_ID", ""))
+  return sha.new(s).hexdigest()
+
+def snapshot_memcached_key(key_name):
+  return "snapshot:" + key_name
+
+# returns a snapshot that's up to date for a forum, or None
+def get_topic_snapshot(key_name, forum):
+  key = snapshot_memcached_key(key_name)
+  snapshot = memcache.get(key)
+  if snapshot is None:
+    snapshot = TopicSnapshot.get_by_key_name(key_name)
+    memcache.set(key, snapshot or False)
+  if not snapshot:
+    return None
+  if TopicSnapshot.forum.get_value_for_datastore(snapshot) != forum.key():
+    return None
+  if snapshot.fingerprint != snapshot_fingerprint(forum):
+    return None
+  return snapshot
+
+def save_topic_snapshot(key_name, forum, topic_id, page_token, next_page, html, etag, last_modified):
+  if isinstance(html, unicode):
+    html = html.encode('utf-8')
+  gzip_parts = [db.Blob(part) for part in deflate_parts(html) or []]
+  snapshot = TopicSnapshot(key_name=key_name, forum=forum, topic_id=topic_id, page_token=page_token, next_page=next_page, html=html, gzip_parts=gzip_parts, etag=etag, last_modified=last_modified, fingerprint=snapshot_fingerprint(forum))
+  snapshot.put()
+  memcache.set(snapshot_memcached_key(key_name), snapshot)
+  return snapshot
+
+# deletes snapshots of a topic, for all skins, viewers and pages
+def delete_topic_snapshots(topic_id):
+  keys = list(iter_keys("TopicSnapshot", "topic_id = :1", topic_id))
+  if not keys:
+    return
+  delete_in_batches(keys)
+  memcache.delete_multi([snapshot_memcached_key(key.name()) for key in keys])
+
+# Cache-Control max-age for pages that can change any time and for archived
+# topics, which only change when a moderator (un)deletes a post
+LIVE_MAX_AGE = 60
+ARCHIVED_MAX_AGE = 24*60*60
+
+# pages that differ per user (e.g. have user's name in log in/out links)
+# must only be cached by user's browser
+def set_cache_control(response, max_age, private=False):
+  if private:
+    response.headers['Cache-Control'] = 'private, max-age=%d' % max_age
+  else:
+    response.headers['Cache-Control'] = 'public, max-age=%d' % max_age
+
+# datastore limits the number of entities in a single batch put
+PUT_BATCH_SIZE = 100
+
+def put_in_batches(entities):
+  for i in range(0, len(entities), PUT_BATCH_SIZE):
+    db.put(entities[i:i+PUT_BATCH_SIZE])
+
+def delete_in_batches(keys):
+  for i in range(0, len(keys), PUT_BATCH_SIZE):
+    db.delete(keys[i:i+PUT_BATCH_SIZE])
+
+# number of keys read from the datastore at a time by iter_keys()
+KEYS_BATCH_SIZE = 500
+
+# yields keys of all entities of a kind matching GQL condition where, with
+# args bound to :1, :2 etc. Keys are read in batches in key order, so unlike
+# count() and fetch() it isn't limited to 1000 entities
+def iter_keys(kind, where, *args):
+  gql = "SELECT __key__ FROM %s WHERE %s" % (kind, where)
+  keys = db.GqlQuery(gql + " ORDER BY __key__", *args).fetch(KEYS_BATCH_SIZE)
+  while keys:
+    for key in keys:
+      yield key
+    if len(keys) < KEYS_BATCH_SIZE:
+      return
+    after = " AND __key__ > :%d ORDER BY __key__" % (len(args) + 1)
+    keys = db.GqlQuery(gql + after, *(args + (keys[-1],))).fetch(KEYS_BATCH_SIZE)
+
+# FofouUser for anonymous users has a key name derived from the cookie, so
+# that we can get it by key instead of querying. Users created before
+# that don't have a key name and are found with a query
+def anon_user_key_name(cookie):
+  return "c" + cookie
+
+# lookups of FofouUser are cached in memcache under a key derived from
+# google user or cookie. False is cached if there's no user
+def fofou_user_memcached_key(user_id, cookie):
+  if user_id:
+    return "fofouuser:u:" + user_id.email()
+  return "fofouuser:c:" + cookie
+
+def get_fofou_user(ctx):
+  # get user either by google user id or cookie
+  user_id = ctx.user
+  cookie = None
+  if not user_id:
+    cookie = get_fofou_cookie_val(ctx)
+    # there can't be a user for a cookie we've just created
+    if not cookie or ctx.fofou_cookie_is_new:
+      return None
+  key = fofou_user_memcached_key(user_id, cookie)
+  user = memcache.get(key)
+  if user is not None:
+    return user or None
+  if user_id:
+    user = FofouUser.gql("WHERE user = :1", user_id).get()
+    #if user: logging.info("Found existing user for by user_id '%s'" % str(user_id))
+  else:
+    user = FofouUser.get_by_key_name(anon_user_key_name(cookie))
+    if not user:
+      user = FofouUser.gql("WHERE cookie = :1", cookie).get()
+    #if user:
+    #  logging.info("Found existing user for cookie '%s'" % cookie)
+    #else:
+    #  logging.info("Didn't find user for cookie '%s'" % cookie)
+  memcache.set(key, user or False)
+  return user
+
+# saves the user and updates cached lookup
+def save_fofou_user(user):
+  user.put()
+  memcache.set(fofou_user_memcached_key(user.user, user.cookie), user)
@@ -0,0 +1,263 @@
+# This code is in Public Domain. Take all the code you want, we'll just write more.
+#!/usr/bin/env python
+import os, sys, re, time, shutil, getpass
+from optparse import OptionParser
+try:
+  import multiprocessing
+except ImportError:
+  multiprocessing = None
+
+# Exports a forum as static html files, for a read-only mirror that can be
+# served by any web server: index.html and page-<n>.html with the list of
+# topics and topic-<id>.html for every topic, rendered with skins/default
+# templates. Deleted topics and posts are not exported. Usage:
+#   python export_forum.py [options] <forum url> <output directory>
+# Data is read either from a deployed app, through remote_api (--remote,
+# needs /remote_api handler from app.yaml), or from a datastore file of
+# development server (--datastore). Entities are read in batches, posts
+# topic by topic as topic pages are rendered by a pool of --processes
+# processes.
+
+APPENGINE_SDK = "/usr/local/google_appengine"
+APP_ID = "fofou"
+
+SKIN_DIR = os.path.join("skins", "default")
+TOPICS_PER_PAGE = 75
+# number of entities read from the datastore in one call
+BATCH_SIZE = 500
+# number of pages sent to a worker process at a time
+PAGES_PER_JOB = 20
+
+def setup_sdk(sdk, app_id):
+  sys.path = [sdk,
+    os.path.join(sdk, "lib", "django"),
+    os.path.join(sdk, "lib", "webob"),
+    os.path.join(sdk, "lib", "yaml", "lib")] + sys.path
+  os.environ["APPLICATION_ID"] = app_id
+  os.environ["AUTH_DOMAIN"] = "gmail.com"
+  os.environ["SERVER_NAME"] = "localhost"
+  os.environ["USER_EMAIL"] = ""
+
+def setup_remote_datastore(app_id, host):
+  from google.appengine.ext.remote_api import remote_api_stub
+  def auth_func():
+    return (raw_input("Email: "), getpass.getpass("Password: "))
+  remote_api_stub.ConfigureRemoteDatastore(app_id, "/remote_api", auth_func, host)
+
+def setup_local_datastore(app_id, path):
+  from google.appengine.api import apiproxy_stub_map, datastore_file_stub
+  apiproxy_stub_map.apiproxy = apiproxy_stub_map.APIProxyStubMap()
+  stub = datastore_file_stub.DatastoreFileStub(app_id, path, None)
+  apiproxy_stub_map.apiproxy.RegisterStub("datastore_v3", stub)
+
+# Entities are converted to these as soon as they're read, so that only the
+# data needed for rendering is kept in memory and sent to worker processes.
+# Templates use topic.key.id and post.key.id, hence Key
+class Key(object):
+  def __init__(self, id):
+    self.id = id
+
+class Record(object):
+  def __init__(self, **kwargs):
+    self.__dict__.update(kwargs)
+
+def forum_record(forum):
+  return Record(url=forum.url, title=forum.title, tagline=forum.tagline, sidebar=forum.sidebar)
+
+def topic_record(topic):
+  return Record(key=Key(topic.key().id()), subject=topic.subject, created_by=topic.created_by, created_on=topic.created_on, ncomments=topic.ncomments, msg_short=topic.msg_short or "", is_deleted=False)
+
+def post_record(post):
+  return Record(key=Key(post.key().id()), html=post.html(), user_name=post.user_name, user_homepage=post.user_homepage, created_on=post.created_on, is_deleted=False)
+
+# yields entities of a model with a given value of a property, reading them
+# in batches in key order
+def iter_entities(model, prop, value):
+  entities = model.gql("WHERE %s = :1 ORDER BY __key__" % prop, value).fetch(BATCH_SIZE)
+  while entities:
+    for entity in entities:
+      yield entity
+    if len(entities) < BATCH_SIZE:
+      break
+    entities = model.gql("WHERE %s = :1 AND __key__ > :2 ORDER BY __key__" % prop, value, entities[-1].key()).fetch(BATCH_SIZE)
+
+# returns records of non-deleted topics, newest first
+def read_topics(models, forum):
+  topics = []
+  n = 0
+  for topic in iter_entities(models.Topic, "forum", forum):
+    n += 1
+    if not topic.is_deleted:
+      topics.append(topic_record(topic))
+  print("read %d topics" % n)
+  topics.sort(lambda x, y: cmp(y.created_on, x.created_on))
+  return topics
+
+# returns records of non-deleted posts of a topic, oldest first
+def read_topic_posts(models, topic_id):
+  topic_key = models.db.Key.from_path("Topic", topic_id)
+  posts = [post_record(post) for post in iter_entities(models.Post, "topic", topic_key) if not post.is_deleted]
+  posts.sort(lambda x, y: cmp(x.created_on, y.created_on))
+  return posts
+
+# Pages are rendered with siteroot "" so links are relative, which is then
+# fixed up for links that only work with the app (topic?id=<id> etc.)
+LINK_REWRITES = [
+  (re.compile(r'href="topic\?id=(\d+)[^"#]*'), r'href="topic-\1.html'),
+  (re.compile(r'href="\?after=(page-\d+)"'), r'href="\1.html"'),
+  (re.compile(r'href=""'), r'href="index.html"'),
+  (re.compile(r'''(["'])/(static|img)/'''), r'\1\2/'),
+]
+
+def rewrite_links(html):
+  for (regexp, repl) in LINK_REWRITES:
+    html = regexp.sub(repl, html)
+  return html
+
+# renders a list of (template name, file name, template values) to files
+# in outdir. Runs in worker processes. Returns number of bytes written
+def render_pages(args):
+  (outdir, pages) = args
+  from google.appengine.ext.webapp import template
+  nbytes = 0
+  for (template_name, file_name, tvals) in pages:
+    html = template.render(os.path.join(SKIN_DIR, template_name), tvals)
+    if isinstance(html, unicode):
+      html = html.encode('utf-8')
+    html = rewrite_links(html)
+    f = open(os.path.join(outdir, file_name), "wb")
+    f.write(html)
+    f.close()
+    nbytes += len(html)
+  return nbytes
+
+def init_worker(sdk, app_id):
+  if sdk not in sys.path:
+    setup_sdk(sdk, app_id)
+
+def page_file_name(page_no):
+  if 0 == page_no:
+    return "index.html"
+  return "page-%d.html" % (page_no + 1)
+
+# Topic pages are rendered as posts of each topic are read, so only posts of
+# topics waiting to be rendered are kept in memory. Yields lists of pages to
+# render, PAGES_PER_JOB at a time. Topics with no posts to show are dropped
+# from topics and number of exported posts is added to stats["posts"]
+def iter_topic_jobs(outdir, models, forum, topics, stats):
+  pages = []
+  exported = []
+  for topic in topics:
+    posts = read_topic_posts(models, topic.key.id)
+    if not posts:
+      continue
+    exported.append(topic)
+    stats["posts"] += len(posts)
+    tvals = {
+      'siteroot' : "",
+      'forum' : forum,
+      'topic' : topic,
+      'is_moderator' : False,
+      'is_archived' : True,
+      'posts' : posts,
+      'log_in_out' : "",
+      'static_export' : True,
+    }
+    pages.append(("topic.html", "topic-%d.html" % topic.key.id, tvals))
+    if len(pages) >= PAGES_PER_JOB:
+      yield (outdir, pages)
+      pages = []
+  if pages:
+    yield (outdir, pages)
+  topics[:] = exported
+
+# yields lists of topic list pages to render
+def iter_list_jobs(outdir, forum, topics, nposts):
+  pages = []
+  for start in range(0, max(len(topics), 1), TOPICS_PER_PAGE):
+    page_no = start / TOPICS_PER_PAGE
+    page_topics = topics[start:start + TOPICS_PER_PAGE]
+    next_page = None
+    if start + TOPICS_PER_PAGE < len(topics):
+      next_page = page_file_name(page_no + 1)[:-len(".html")]
+    tvals = {
+      'siteroot' : "",
+      'forum' : forum,
+      'topics' : page_topics,
+      'from' : start,
+      'to' : start + len(page_topics),
+      'next_page' : next_page,
+      'ntopics' : len(topics),
+      'nposts' : nposts,
+      'log_in_out' : "",
+      'static_export' : True,
+    }
+    pages.append(("topic_list.html", page_file_name(page_no), tvals))
+    if len(pages) >= PAGES_PER_JOB:
+      yield (outdir, pages)
+      pages = []
+  if pages:
+    yield (outdir, pages)
+
+def copy_static_files(outdir):
+  for name in ["static", "img"]:
+    dst = os.path.join(outdir, name)
+    if os.path.exists(dst):
+      shutil.rmtree(dst)
+    shutil.copytree(name, dst)
+
+def main():
+  parser = OptionParser(usage="%prog [options] <forum url> <output directory>")
+  parser.add_option("--sdk", default=APPENGINE_SDK, help="path to App Engine SDK")
+  parser.add_option("--app-id", dest="app_id", default=APP_ID)
+  parser.add_option("--remote", help="host of deployed app, e.g. fofou.appspot.com")
+  parser.add_option("--datastore", help="datastore file of development server")
+  parser.add_option("--processes", type="int", default=4, help="number of rendering processes")
+  (options, args) = parser.parse_args()
+  if len(args) != 2 or not (options.remote or options.datastore):
+    parser.print_help()
+    return
+  (forum_url, outdir) = args
+  if not os.path.exists(options.sdk):
+    print("App Engine SDK not found at '%s'" % options.sdk)
+    return
+  # templates and static files are found relative to fofou directory
+  outdir = os.path.abspath(outdir)
+  os.chdir(os.path.dirname(os.path.abspath(__file__)))
+  sys.path.insert(0, os.getcwd())
+  setup_sdk(options.sdk, options.app_id)
+  if options.remote:
+    setup_remote_datastore(options.app_id, options.remote)
+  else:
+    setup_local_datastore(options.app_id, options.datastore)
+  import models
+
+  start = time.time()
+  forum = models.Forum.gql("WHERE url = :1", forum_url).get()
+  if not forum:
+    print("There's no forum '%s'" % forum_url)
+    return
+  topics = read_topics(models, forum)
+  print("read topics in %.1f s" % (time.time() - start))
+
+  if not os.path.exists(outdir):
+    os.makedirs(outdir)
+  copy_static_files(outdir)
+  render_start = time.time()
+  pool = None
+  if multiprocessing and options.processes > 1:
+    pool = multiprocessing.Pool(options.processes, init_worker, (options.sdk, options.app_id))
+  def render(jobs):
+    if pool:
+      return sum(pool.imap_unordered(render_pages, jobs))
+    return sum([render_pages(job) for job in jobs])
+  # topic list pages need the topics and number of posts known after all
+  # topic pages are done
+  stats = {"posts" : 0}
+  nbytes = render(iter_topic_jobs(outdir, models, forum_record(forum), topics, stats))
+  nbytes += render(iter_list_jobs(outdir, forum_record(forum), topics, stats["posts"]))
+  print("rendered %d topics, %d posts (%d kB) in %.1f s" % (len(topics), stats["posts"], nbytes / 1024, time.time() - render_start))
+  print("total %.1f s" % (time.time() - start))
+
+if __name__ == "__main__":
+  main()
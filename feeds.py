@@ -0,0 +1,172 @@
+# This code is in Public Domain. Take all the code you want, we'll just write more.
+import sha, time, heapq
+from google.appengine.api import memcache
+from google.appengine.ext import db
+from django.utils import feedgenerator
+from common import *
+
+# returns first posts of topics, fetched with a single batch get. Topics
+# that don't have first_post set fall back to a query
+def get_first_posts(topics):
+  keys = [Topic.first_post.get_value_for_datastore(topic) for topic in topics]
+  posts = {}
+  known_keys = [k for k in keys if k]
+  if known_keys:
+    for post in db.get(known_keys):
+      if post:
+        posts[post.key()] = post
+  res = []
+  for (topic, key) in zip(topics, keys):
+    post = posts.get(key)
+    if not post:
+      post = Post.gql("WHERE topic = :1 ORDER BY created_on", topic).get()
+    res.append(post)
+  return res
+
+# returns topics of posts, fetched with a single batch get
+def get_topics_of_posts(posts):
+  keys = [Post.topic.get_value_for_datastore(post) for post in posts]
+  topics = {}
+  unique_keys = dict([(k, True) for k in keys]).keys()
+  if unique_keys:
+    for topic in db.get(unique_keys):
+      if topic:
+        topics[topic.key()] = topic
+  return [topics.get(k) for k in keys]
+
+# Base class for feed handlers. Feeds are cached in memcache per forum and
+# per feed type and served with ETag/Last-Modified so that feed readers
+# polling us get 304 instead of a full feed. Subclasses set FEED_TYPE and
+# implement build_feed(forum, siteroot), returning feed text
+class FeedHandler(FofouHandler):
+  FEED_TYPE = None
+
+  def get(self):
+    (forum, siteroot, tmpldir) = forum_siteroot_tmpldir_from_url(self.request.path_info)
+    if not forum or forum.is_disabled:
+      return self.error(HTTP_NOT_FOUND)
+    key = feed_memcached_key(self.FEED_TYPE, forum)
+    self.feed_out(key, lambda: self.build_feed(forum, siteroot))
+
+  # writes feed cached under key (along with its gzip version), building it
+  # with build_fn() if not cached
+  def feed_out(self, key, build_fn):
+    cached_feed = memcache.get(key)
+    if cached_feed is None:
+      feedtxt = build_fn()
+      etag = '"%s"' % sha.new(feedtxt).hexdigest()
+      cached_feed = (feedtxt, gzip_variant(feedtxt), etag, int(time.time()))
+      memcache.set(key, cached_feed)
+    (feedtxt, gzfeed, etag, last_modified) = cached_feed
+
+    self.response.headers['Content-Type'] = 'text/xml'
+    gzip_fn = None
+    if gzfeed:
+      gzip_fn = lambda: gzfeed
+    compressed_out(self.request, self.response, feedtxt, gzip_fn, etag, last_modified)
+
+# number of items in a feed
+FEED_ITEMS = 25
+
+# feed items are (pubdate, title, link, description) tuples
+def write_feed(title, link, description, items):
+  feed = feedgenerator.Atom1Feed(title=title, link=link, description=description)
+  for (pubdate, title, link, description) in items:
+    feed.add_item(title=title, link=link, description=description, pubdate=pubdate)
+  return feed.writeString('utf-8')
+
+# responds to /<forumurl>/rss, returns an RSS feed of recent topics
+# (taking into account only the first post in a topic - that's what
+# joelonsoftware forum rss feed does)
+class RssFeed(FeedHandler):
+  FEED_TYPE = "rss"
+
+  def build_feed(self, forum, siteroot):
+    topics = Topic.gql("WHERE forum = :1 AND is_deleted = False ORDER BY created_on DESC", forum).fetch(FEED_ITEMS)
+    first_posts = get_first_posts(topics)
+    items = []
+    for (topic, first_post) in zip(topics, first_posts):
+      if not first_post:
+        continue
+      title = topic.subject
+      link = siteroot + "topic?id=" + str(topic.key().id())
+      msg = first_post.html()
+      name = topic.created_by
+      description = template_render(FEED_ITEM_TEMPLATE, {"msg": msg, "name" : name})
+      items.append((topic.created_on, title, link, description))
+    return write_feed(forum.title or forum.url, siteroot + "rss", forum.tagline, items)
+
+# returns feed items for most recent posts in a forum, newest first. They're
+# cached separately from the feed, so that /rsscombined can re-use them
+def get_recent_post_items(forum, siteroot, gen=None):
+  key = feed_memcached_key("rssall-items", forum, gen)
+  items = memcache.get(key)
+  if items is None:
+    items = build_recent_post_items(forum, siteroot)
+    memcache.set(key, items)
+  return items
+
+def build_recent_post_items(forum, siteroot):
+  posts = Post.gql("WHERE forum = :1 AND is_deleted = False ORDER BY created_on DESC", forum).fetch(FEED_ITEMS)
+  topics = get_topics_of_posts(posts)
+  items = []
+  for (post, topic) in zip(posts, topics):
+    if not topic:
+      continue
+    title = topic.subject
+    link = siteroot + "topic?id=" + str(topic.key().id())
+    msg = post.html()
+    name = post.user_name
+    description = template_render(FEED_ITEM_TEMPLATE, {"msg": msg, "name" : name})
+    items.append((post.created_on, title, link, description))
+  return items
+
+# responds to /<forumurl>/rssall, returns an RSS feed of all recent posts
+# This is good for forum admins/moderators who want to monitor all posts
+class RssAllFeed(FeedHandler):
+  FEED_TYPE = "rssall"
+
+  def build_feed(self, forum, siteroot):
+    items = get_recent_post_items(forum, siteroot)
+    return write_feed(forum.title or forum.url, siteroot + "rssall", forum.tagline, items)
+
+# merges lists of feed items, each sorted newest first, into one list of
+# up to limit newest items
+def merge_feed_items(item_lists, limit):
+  heap = []
+  for (n, items) in enumerate(item_lists):
+    if items:
+      # negated timestamp makes heapq (a min-heap) return newest item first
+      heapq.heappush(heap, (-datetime_to_usec(items[0][0]), n, 0))
+  res = []
+  while heap and len(res) < limit:
+    (neg_usec, n, i) = heapq.heappop(heap)
+    res.append(item_lists[n][i])
+    if i + 1 < len(item_lists[n]):
+      heapq.heappush(heap, (-datetime_to_usec(item_lists[n][i+1][0]), n, i + 1))
+  return res
+
+# responds to /rsscombined, returns an RSS feed of recent posts in all
+# forums, merged from items of /<forumurl>/rssall feeds. It's cached under
+# a key made of feed generations of all forums, so it's rebuilt when any of
+# them changes. Each forum's list has at most FEED_ITEMS items, so that's
+# also as many as the merged feed can have without skipping posts of a busy
+# forum for older posts of quiet ones
+class RssCombinedFeed(FeedHandler):
+
+  def get(self):
+    forums = [forum for forum in get_forums() if not forum.is_disabled]
+    gens = get_cache_gens("feed", forums)
+    parts = ["%s:%d" % (str(forum.key()), gen) for (forum, gen) in zip(forums, gens)]
+    key = "feed:combined:" + sha.new(",".join(parts)).hexdigest()
+    self.feed_out(key, lambda: self.build_combined_feed(forums, gens))
+
+  def build_combined_feed(self, forums, gens):
+    item_lists = []
+    for (forum, gen) in zip(forums, gens):
+      siteroot = forum_root(forum)
+      forum_title = forum.title or forum.url
+      items = get_recent_post_items(forum, siteroot, gen)
+      item_lists.append([(pubdate, "[%s] %s" % (forum_title, title), link, description) for (pubdate, title, link, description) in items])
+    items = merge_feed_items(item_lists, FEED_ITEMS)
+    return write_feed("All forums", "/rsscombined", "Recent posts in all forums", items)
@@ -1,150 +1,253 @@
-# This code is in Public Domain. Take all the code you want, we'll just write more.
-import pickle, bz2, os.path, string, urlparse, httplib, traceback, StringIO, datetime, sys
-from offsets import *
-
-# Uploads posts dumped with fruitshow_dump_data.py to fofou
-
-# you need to provide full url to a given forum's posting interface e.g.
-# http://foo.com/myforum/importfruitshow
-FOFOU_SERVER = ""
-# You need to provide import secret for this forum (can be set by forum
-# admin in forum management web page)
-IMPORT_SECRET = ""
-
-PICKLED_DATA_FILE_NAME = "fruitshow_posts.dat.bz2"
-
-def encode_multipart_formdata(fields, files):
-    """
-    fields is a sequence of (name, value) elements for regular form fields.
-    files is a sequence of (name, filename, value) elements for data to be uploaded as files
-    Return (content_type, body) ready for httplib.HTTP instance
-    """
-    BOUNDARY = '----------ThIs_Is_tHe_bouNdaRY_$'
-    CRLF = '\r\n'
-    L = []
-    assert fields or files
-    if fields:
-        for (key, value) in fields:
-            L.append('--' + BOUNDARY)
-            L.append('Content-Disposition: form-data; name="%s"' % key)
-            L.append('')
-            L.append(value)
-    if files:
-        for (key, filename, value) in files:
-            L.append('--' + BOUNDARY)
-            L.append('Content-Disposition: form-data; name="%s"; filename="%s"' % (key, filename))
-            L.append('Content-Type: %s' % get_content_type(filename))
-            L.append('')
-            L.append(value)
-    L.append('--' + BOUNDARY + '--')
-    L.append('')
-    body = CRLF.join(L)
-    content_type = 'multipart/form-data; boundary=%s' % BOUNDARY
-    return content_type, body
-
-# from http://aspn.activestate.com/ASPN/Cookbook/Python/Recipe/146306
-def post_multipart(host, selector, fields, files, username=None, pwd=None):
-    """
-    Post fields and files to an http host as multipart/form-data.
-    fields is a sequence of (name, value) elements for regular form fields.
-    files is a sequence of (name, filename, value) elements for data to be uploaded as files
-    Return the server's response page.
-    """
-    #print("post_multipart selector=%s" % selector)
-    data = None
-    try:
-        content_type, body = encode_multipart_formdata(fields, files)
-        conn = httplib.HTTPConnection(host)
-        conn.putrequest('POST', selector)
-        conn.putheader('Content-Type', content_type)
-        conn.putheader('Content-Length', str(len(body)))
-        if username:
-            assert(pwd)
-            conn.putheader('Authorization', "Basic %s" % gen_base_auth_header_val(username, pwd))
-        conn.endheaders()
-        #print "post_multipart() body: '%s'" % body
-        conn.send(body)
-        resp = conn.getresponse()
-        #err = resp.status
-        data = resp.read()
-    except:
-        print "post_multipart failed"
-        print '-'*60
-        traceback.print_exc(file=sys.stdout)
-        print '-'*60
-    #print data
-    return data
-
-def do_http_post_fields(url, fields, username=None, pwd=None):
-    #print("do_http_post_fields url=%s" % url)
-    url_parts = urlparse.urlparse(url)
-    host = url_parts.netloc
-    selector = url_parts.path
-    if url_parts.query:
-        selector = selector + "?" + url_parts.query
-    return post_multipart(host, selector, fields, None, username, pwd)
-
-def upload_post(url, topic_txt):
-  fields = [('topicdata', topic_txt), ('importsecret', IMPORT_SECRET)]
-  do_http_post_fields(url, fields)
-
-def to_datetime(val):
-  #print("type of '%s' is '%s'" % (str(val), type(val)))
-  dt = datetime.datetime.utcfromtimestamp(val)
-  #print("'%s' is '%s'" % (str(val), dt.isoformat()))
-  return dt
-
-def main():
-  if not FOFOU_SERVER:
-    print("You need to set FOFOU_SERVER")
-    return
-  if not IMPORT_SECRET:
-    print("You need to set IMPORT_SECRET")
-    return
-  if "/importfruitshow" not in FOFOU_SERVER:
-    print("FOFOU_SERVER url ('%s') doesn't look valid (doesn't end with '/importfruitshow')" % FOFOU_SERVER)
-    return
-  if not os.path.exists(PICKLED_DATA_FILE_NAME):
-    print("File %s doesn't exists" % PICKLED_DATA_FILE_NAME)
-    return
-  print("Reading '%s'" % PICKLED_DATA_FILE_NAME)
-  fo = bz2.BZ2File(PICKLED_DATA_FILE_NAME, "r")
-  data = pickle.load(fo)
-  fo.close()
-  print("Finished reading")
-  all_topics = data["topics"]
-
-  # convert dates from numeric value to datetime instance, as required by
-  # /topicimport interface and post body to unicode
-  all_posts = data["posts"]
-  new_all_posts = []
-  for p in all_posts:
-    new_p = [el for el in p]
-    new_p[POST_POSTED_ON] = to_datetime(new_p[POST_POSTED_ON])
-    #new_p[POST_MSG] = to_unicode(new_p[POST_MSG])
-    new_all_posts.append(new_p)
-  all_posts = new_all_posts
-  topic_posts = data["topic_posts"]
-  topics_count = len(all_topics)
-  print("%d topics, %d posts" % (topics_count, len(all_posts)))
-  sent = 0
-  for topic in all_topics:
-    topic_id = topic[TOPIC_ID]
-    post_ids = [p[TP_POST_ID] for p in topic_posts if topic_id == p[TP_TOPIC_ID]]
-    posts = [p for p in all_posts if p[POST_ID] in post_ids]
-    topic_data = (topic, posts)
-    fo = StringIO.StringIO()
-    pickle.dump(topic_data, fo)
-    topic_pickled = fo.getvalue()
-    fo.close()
-    #print("Subject: '%s'" % topic[TOPIC_SUBJECT])
-    #print("uploading topic %s" % topic_id)
-    sent = sent + 1
-    deleted = posts[0][POST_DELETED]
-    print("Uploading topic %d (out of %d), deleted = '%s'" % (sent, topics_count, str(deleted)))
-    upload_post(FOFOU_SERVER, topic_pickled)
-    #break
-
-if __name__ == "__main__":
-  main()
-
+# This code is in Public Domain. Take all the code you want, we'll just write more.
+import pickle, bz2, os.path, string, urlparse, httplib, traceback, StringIO, datetime, sys
+import threading, Queue, socket, time
+from offsets import *
+from fruitshow_stream import *
+
+# Uploads posts dumped with fruitshow_dump_data.py to fofou
+
+# you need to provide full url to a given forum's posting interface e.g.
+# http://foo.com/myforum/importfruitshow
+FOFOU_SERVER = ""
+# You need to provide import secret for this forum (can be set by forum
+# admin in forum management web page)
+IMPORT_SECRET = ""
+
+# data dumped by fruitshow_dump_data.py is read from STREAM_DATA_FILE_NAME.
+# Files in older format (everything pickled into one bzip2ed dictionary)
+# are still supported, but have to be loaded into memory
+PICKLED_DATA_FILE_NAME = "fruitshow_posts.dat.bz2"
+
+# ids of topics that have been uploaded are appended to this file, so that
+# re-running the script after a crash resumes where it stopped. Delete it
+# to upload everything again
+CHECKPOINT_FILE_NAME = "fruitshow_upload.checkpoint"
+
+# number of concurrent uploads, each over its own keep-alive connection
+NTHREADS = 4
+# number of topics sent in a single request
+TOPICS_PER_REQUEST = 25
+MAX_RETRIES = 3
+
+def encode_multipart_formdata(fields, files):
+    """
+    fields is a sequence of (name, value) elements for regular form fields.
+    files is a sequence of (name, filename, value) elements for data to be uploaded as files
+    Return (content_type, body) ready for httplib.HTTP instance
+    """
+    BOUNDARY = '----------ThIs_Is_tHe_bouNdaRY_$'
+    CRLF = '\r\n'
+    L = []
+    assert fields or files
+    if fields:
+        for (key, value) in fields:
+            L.append('--' + BOUNDARY)
+            L.append('Content-Disposition: form-data; name="%s"' % key)
+            L.append('')
+            L.append(value)
+    if files:
+        for (key, filename, value) in files:
+            L.append('--' + BOUNDARY)
+            L.append('Content-Disposition: form-data; name="%s"; filename="%s"' % (key, filename))
+            L.append('Content-Type: %s' % get_content_type(filename))
+            L.append('')
+            L.append(value)
+    L.append('--' + BOUNDARY + '--')
+    L.append('')
+    body = CRLF.join(L)
+    content_type = 'multipart/form-data; boundary=%s' % BOUNDARY
+    return content_type, body
+
+def to_datetime(val):
+  #print("type of '%s' is '%s'" % (str(val), type(val)))
+  dt = datetime.datetime.utcfromtimestamp(val)
+  #print("'%s' is '%s'" % (str(val), dt.isoformat()))
+  return dt
+
+def convert_posts(posts):
+  res = []
+  for p in posts:
+    new_p = [el for el in p]
+    # convert dates from numeric value to datetime instance, as required by
+    # /importfruitshow interface
+    new_p[POST_POSTED_ON] = to_datetime(new_p[POST_POSTED_ON])
+    res.append(new_p)
+  return res
+
+# yields (topic, posts) tuples from a file in streaming format, one at a time
+def iter_stream_topics(file_name):
+  fo = open(file_name, "rb")
+  try:
+    for (topic, posts) in iter_records(fo):
+      yield (topic, convert_posts(posts))
+  finally:
+    fo.close()
+
+# yields (topic, posts) tuples from data in older format, joining posts to
+# topics through topic_posts with hash indexes
+def iter_pickled_topics(data):
+  posts_by_id = {}
+  for p in convert_posts(data["posts"]):
+    posts_by_id[p[POST_ID]] = p
+  post_ids_by_topic = {}
+  for tp in data["topic_posts"]:
+    post_ids_by_topic.setdefault(tp[TP_TOPIC_ID], []).append(tp[TP_POST_ID])
+  for topic in data["topics"]:
+    post_ids = post_ids_by_topic.get(topic[TOPIC_ID], [])
+    posts = [posts_by_id[post_id] for post_id in post_ids if post_id in posts_by_id]
+    posts.sort(key=lambda p: p[POST_ID])
+    yield (topic, posts)
+
+def load_checkpoint():
+  done = {}
+  if os.path.exists(CHECKPOINT_FILE_NAME):
+    for line in open(CHECKPOINT_FILE_NAME):
+      line = line.strip()
+      if line:
+        done[int(line)] = True
+  return done
+
+# uploads batches of topics from a queue using a pool of threads
+class Uploader(object):
+  # topics_count is None if not known upfront
+  def __init__(self, url, topics_count):
+    url_parts = urlparse.urlparse(url)
+    self.host = url_parts.netloc
+    self.selector = url_parts.path
+    if url_parts.query:
+      self.selector = self.selector + "?" + url_parts.query
+    self.topics_count = topics_count
+    self.lock = threading.Lock()
+    self.checkpoint = open(CHECKPOINT_FILE_NAME, "a")
+    self.start_time = time.time()
+    self.topics_sent = 0
+    self.bytes_sent = 0
+    self.topics_failed = 0
+    self.queue = Queue.Queue(NTHREADS * 2)
+    self.threads = [threading.Thread(target=self.worker) for i in range(NTHREADS)]
+    for t in self.threads:
+      t.setDaemon(True)
+      t.start()
+
+  def add(self, batch):
+    self.queue.put(batch)
+
+  def finish(self):
+    for t in self.threads:
+      self.queue.put(None)
+    for t in self.threads:
+      t.join()
+    self.checkpoint.close()
+    self.print_stats()
+
+  def worker(self):
+    conn = None
+    while True:
+      batch = self.queue.get()
+      if batch is None:
+        break
+      conn = self.upload_batch(conn, batch)
+    if conn:
+      conn.close()
+
+  # returns connection to re-use for the next batch
+  def upload_batch(self, conn, batch):
+    topics_pickled = pickle.dumps(batch, pickle.HIGHEST_PROTOCOL)
+    fields = [('topicsdata', topics_pickled), ('importsecret', IMPORT_SECRET)]
+    content_type, body = encode_multipart_formdata(fields, None)
+    for attempt in range(MAX_RETRIES):
+      try:
+        if not conn:
+          conn = httplib.HTTPConnection(self.host)
+        conn.request('POST', self.selector, body, {'Content-Type' : content_type})
+        resp = conn.getresponse()
+        data = resp.read()
+        if 200 == resp.status:
+          self.batch_done(batch, data, len(body))
+          return conn
+        print("Upload failed with status %d" % resp.status)
+      except (httplib.HTTPException, socket.error), e:
+        print("Upload failed: %s" % str(e))
+      if conn:
+        conn.close()
+        conn = None
+    self.lock.acquire()
+    try:
+      self.topics_failed += len(batch)
+    finally:
+      self.lock.release()
+    return conn
+
+  # server responds with "<topic_no> <status> [<topic_id>]" line per topic
+  def batch_done(self, batch, resp_data, body_len):
+    done = []
+    for line in resp_data.split("\n"):
+      parts = line.split()
+      if len(parts) >= 2:
+        done.append(parts[0])
+    self.lock.acquire()
+    try:
+      for topic_id in done:
+        self.checkpoint.write(topic_id + "\n")
+      self.checkpoint.flush()
+      self.topics_sent += len(done)
+      self.topics_failed += len(batch) - len(done)
+      self.bytes_sent += body_len
+      self.print_stats()
+    finally:
+      self.lock.release()
+
+  def print_stats(self):
+    dur = max(time.time() - self.start_time, 0.001)
+    total = ""
+    if self.topics_count is not None:
+      total = " (out of %d)" % self.topics_count
+    print("Uploaded %d%s topics, %d failed, %.1f topics/s, %.1f kB/s" % (self.topics_sent, total, self.topics_failed, self.topics_sent / dur, self.bytes_sent / dur / 1024.0))
+
+def main():
+  if not FOFOU_SERVER:
+    print("You need to set FOFOU_SERVER")
+    return
+  if not IMPORT_SECRET:
+    print("You need to set IMPORT_SECRET")
+    return
+  if "/importfruitshow" not in FOFOU_SERVER:
+    print("FOFOU_SERVER url ('%s') doesn't look valid (doesn't end with '/importfruitshow')" % FOFOU_SERVER)
+    return
+  topics_count = None
+  if os.path.exists(STREAM_DATA_FILE_NAME):
+    print("Reading '%s'" % STREAM_DATA_FILE_NAME)
+    topics = iter_stream_topics(STREAM_DATA_FILE_NAME)
+  elif os.path.exists(PICKLED_DATA_FILE_NAME):
+    print("Reading '%s'" % PICKLED_DATA_FILE_NAME)
+    fo = bz2.BZ2File(PICKLED_DATA_FILE_NAME, "r")
+    data = pickle.load(fo)
+    fo.close()
+    print("Finished reading")
+    topics_count = len(data["topics"])
+    print("%d topics, %d posts" % (topics_count, len(data["posts"])))
+    topics = iter_pickled_topics(data)
+  else:
+    print("File %s doesn't exists" % STREAM_DATA_FILE_NAME)
+    return
+
+  done = load_checkpoint()
+  if done:
+    print("Skipping %d topics already uploaded according to '%s'" % (len(done), CHECKPOINT_FILE_NAME))
+  if topics_count is not None:
+    topics_count -= len(done)
+  uploader = Uploader(FOFOU_SERVER, topics_count)
+  batch = []
+  for (topic, posts) in topics:
+    if topic[TOPIC_ID] in done:
+      continue
+    batch.append((topic, posts))
+    if len(batch) == TOPICS_PER_REQUEST:
+      uploader.add(batch)
+      batch = []
+  if batch:
+    uploader.add(batch)
+  uploader.finish()
+
+if __name__ == "__main__":
+  main()
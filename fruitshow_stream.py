@@ -0,0 +1,40 @@
+# This code is in Public Domain. Take all the code you want, we'll just write more.
+import struct, zlib, pickle
+
+# Streaming format for fruitshow data, written by fruitshow_dump_data.py and
+# read by fruitshow_dump_upload.py. The file starts with STREAM_MAGIC followed
+# by a sequence of records, one per topic. A record is a 4-byte big-endian
+# length followed by that many bytes of zlib-compressed pickle of
+# (topic, posts) tuple, where topic is a row from Topic table and posts is
+# a list of rows from Post table, ordered by PostId. Each record can be
+# written and read on its own, so memory use doesn't depend on the size of
+# the forum.
+
+STREAM_DATA_FILE_NAME = "fruitshow_topics.dat"
+STREAM_MAGIC = "fofou-fruitshow-stream-1\n"
+
+def write_header(fo):
+  fo.write(STREAM_MAGIC)
+
+def write_record(fo, topic, posts):
+  data = zlib.compress(pickle.dumps((topic, posts), pickle.HIGHEST_PROTOCOL))
+  fo.write(struct.pack(">I", len(data)))
+  fo.write(data)
+  return len(data)
+
+# yields (topic, posts) tuples from a file written with write_record()
+def iter_records(fo):
+  magic = fo.read(len(STREAM_MAGIC))
+  if magic != STREAM_MAGIC:
+    raise ValueError("not a fruitshow stream file")
+  while True:
+    hdr = fo.read(4)
+    if not hdr:
+      break
+    if len(hdr) != 4:
+      raise ValueError("truncated record header")
+    (size,) = struct.unpack(">I", hdr)
+    data = fo.read(size)
+    if len(data) != size:
+      raise ValueError("truncated record")
+    yield pickle.loads(zlib.decompress(data))
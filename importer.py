@@ -0,0 +1,172 @@
+# This code is in Public Domain. Take all the code you want, we'll just write more.
+import sha, pickle, logging
+from google.appengine.ext import db
+from common import *
+from offsets import *
+
+# responds to /<forumurl>/importfruitshow
+# 'topicdata' is a single pickled (topic, posts) tuple. 'topicsdata' is
+# a pickled list of such tuples, imported in one request, in which case the
+# response is a plain text summary, one line per topic:
+# "<topic_no> <status> [<topic_id>]" where status is "imported", "exists"
+# or "empty". Topics that already exist are skipped, so it's safe to re-send
+# a batch after a failure
+class ImportFruitshow(FofouHandler):
+
+  def post(self):
+    (forum, siteroot, tmpldir) = forum_siteroot_tmpldir_from_url(self.request.path_info)
+    if not forum or forum.is_disabled:
+      return self.error(HTTP_NOT_ACCEPTABLE)
+    # not active at all if not protected by secret
+    if not forum.import_secret:
+      logging.info("tried to import topic into '%s' forum, but forum has no import_secret" % forum.url)
+      return self.error(HTTP_NOT_ACCEPTABLE)
+    (topic_pickled, topics_pickled, import_secret) = req_get_vals(self.request, ["topicdata", "topicsdata", 'importsecret'], strip=False)
+    if not topic_pickled and not topics_pickled:
+      logging.info("tried to import topic into '%s' forum, but no 'topicdata' or 'topicsdata' field" % forum.url)
+      return self.error(HTTP_NOT_ACCEPTABLE)
+    if import_secret != forum.import_secret:
+        logging.info("tried to import topic into '%s' forum, but import_secret doesn't match" % forum.url)
+        return self.error(HTTP_NOT_ACCEPTABLE)
+
+    if topics_pickled:
+      topics_data = pickle.loads(topics_pickled)
+    else:
+      topics_data = [pickle.loads(topic_pickled)]
+    results = self.import_topics(forum, topics_data)
+
+    if not topics_pickled:
+      (topic_no, status, topic_id) = results[0]
+      if "imported" != status:
+        return self.error(HTTP_NOT_ACCEPTABLE)
+      return
+    self.response.headers['Content-Type'] = 'text/plain'
+    for (topic_no, status, topic_id) in results:
+      if topic_id:
+        self.response.out.write("%s %s %d\n" % (str(topic_no), status, topic_id))
+      else:
+        self.response.out.write("%s %s\n" % (str(topic_no), status))
+
+  # returns existing topic or None. A topic with is_importing set is
+  # a leftover of an import that failed half-way, so we delete it and its
+  # imported posts and import it again. last_posted_on is the time of the
+  # last imported post: if users replied to the topic since, it's kept
+  def find_existing_topic(self, forum, subject, created_on, last_posted_on):
+    topic = Topic.gql("WHERE forum = :1 AND subject = :2 AND created_on = :3", forum, subject, created_on).get()
+    if not topic or not topic.is_importing:
+      return topic
+    if Post.gql("WHERE topic = :1 AND created_on > :2", topic, last_posted_on).get():
+      logging.info("partially imported topic has new posts, keeping it, subject: %s, created_on: %s" % (subject, str(created_on)))
+      return topic
+    logging.info("deleting partially imported topic, subject: %s, created_on: %s" % (subject, str(created_on)))
+    delete_in_batches(list(iter_keys("Post", "topic = :1", topic.key())))
+    db.delete(topic)
+    return None
+
+  # imports a list of (topic, posts) tuples, writing topics, users and posts
+  # with batch puts. Returns a list of (topic_no, status, topic_id)
+  def import_topics(self, forum, topics_data):
+    results = []
+    to_import = []
+    for (topic, posts) in topics_data:
+      topic_no = topic[TOPIC_ID]
+      if 0 == len(posts):
+        logging.info("There are no posts in topic %s." % str(topic_no))
+        results.append([topic_no, "empty", None])
+        continue
+      subject = to_unicode(topic[TOPIC_SUBJECT])
+      first_post = posts[0]
+      last_post = posts[-1]
+      created_on = first_post[POST_POSTED_ON]
+      #logging.info("subject: %s, created_on: %s" % (subject, str(created_on)))
+      existing = self.find_existing_topic(forum, subject, created_on, last_post[POST_POSTED_ON])
+      if existing:
+        logging.info("topic already exists, subject: %s, created_on: %s" % (subject, str(created_on)))
+        results.append([topic_no, "exists", existing.key().id()])
+        continue
+      created_by = to_unicode(first_post[POST_NAME])
+      topic = Topic(forum=forum, subject=subject, created_on=created_on, created_by=created_by, updated_on = created_on)
+      topic.ncomments = len([p for p in posts[1:] if not int(p[POST_DELETED])])
+      topic.updated_on = last_post[POST_POSTED_ON]
+      topic.is_deleted = bool(int(first_post[POST_DELETED]))
+      topic.is_importing = True
+      result = [topic_no, "imported", None]
+      results.append(result)
+      to_import.append((result, topic, posts))
+    if not to_import:
+      return results
+
+    # users are identified by (name, email, homepage). Each distinct user
+    # in the batch is looked up once and created if doesn't exist
+    users_cache = {}
+    new_users = []
+    posts_vals = []
+    for (result, topic, posts) in to_import:
+      for post in posts:
+        body = to_unicode(post[POST_MSG])
+        name = to_unicode(post[POST_NAME])
+        email = post[POST_EMAIL]
+        homepage = post[POST_URL]
+        (name, email, homepage) = (name.strip(), email.strip(), homepage.strip())
+        if len(homepage) <= len("http://"):
+          homepage = ""
+        user_key = (name, email, homepage)
+        if user_key not in users_cache:
+          user = FofouUser.gql("WHERE name = :1 AND email = :2 AND homepage = :3", name, email, homepage).get()
+          if not user:
+            #logging.info("Didn't find user for name='%s', email='%s', homepage='%s'. Creating one." % (name, email, homepage))
+            cookie = new_user_id()
+            user = FofouUser(key_name=anon_user_key_name(cookie), cookie=cookie, name=name, homepage=homepage, email=email)
+            new_users.append(user)
+          users_cache[user_key] = user
+        posts_vals.append((topic, post, body, user_key))
+    put_in_batches(new_users)
+    put_in_batches([topic for (result, topic, posts) in to_import])
+
+    new_posts = []
+    first_posts = {}
+    last_posts = {}
+    topic_posts = {}
+    for (topic, post, body, user_key) in posts_vals:
+      (name, email, homepage) = user_key
+      created_on = post[POST_POSTED_ON]
+      # this is already an integer, not string
+      user_ip = post[POST_POSTER_IP]
+      is_deleted = bool(int(post[POST_DELETED]))
+      # sha.new() doesn't accept Unicode strings, so convert to utf8 first
+      body_utf8 = body.encode('UTF-8')
+      s = sha.new(body_utf8)
+      sha1_digest = s.hexdigest()
+      new_post = Post(topic=topic, forum=forum, created_on=created_on, message=body, sha1_digest=sha1_digest, is_deleted=is_deleted, user_ip=user_ip, user=users_cache[user_key])
+      new_post.user_name = name
+      new_post.user_email = email
+      new_post.user_homepage = homepage
+      new_post.render_html()
+      new_posts.append(new_post)
+      if topic.key() not in first_posts:
+        first_posts[topic.key()] = new_post
+      if not is_deleted:
+        last_posts[topic.key()] = new_post
+      topic_posts.setdefault(topic.key(), []).append(new_post)
+    put_in_batches(new_posts)
+    put_in_batches(make_post_digests(forum, new_posts))
+    add_to_digest_bloom(forum, [post.sha1_digest for post in new_posts])
+
+    # clearing is_importing marks a topic as completely imported
+    topics = []
+    for (result, topic, posts) in to_import:
+      topic.is_importing = False
+      topic.set_first_post(first_posts[topic.key()])
+      topic.set_last_post(last_posts.get(topic.key()))
+      topics.append(topic)
+      result[2] = topic.key().id()
+      logging.info("Imported topic %s" % str(result[0]))
+    put_in_batches([make_topic_index(topic, topic_posts[topic.key()]) for topic in topics if not topic.is_deleted])
+    put_in_batches(topics)
+    ntopics = len([topic for topic in topics if not topic.is_deleted])
+    nposts = len([post for post in new_posts if not post.is_deleted])
+    incr_forum_counter(forum, "topics", ntopics)
+    incr_forum_counter(forum, "posts", nposts)
+    invalidate_feeds(forum)
+    invalidate_topic_list(forum)
+    return results
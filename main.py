@@ -1,15 +1,27 @@
 # This code is in Public Domain. Take all the code you want, we'll just write more.
-import os, string, Cookie, sha, time, random, cgi, urllib, datetime, StringIO, pickle
+import startup
+from startup import timed_import, lazy_handler
+import os, sha, random, logging
 import wsgiref.handlers
-from google.appengine.api import users
+
+# modules every request needs, imported (and timed) when an instance starts.
+# App Engine APIs and django are timed separately from our own code
+STARTUP_MODULES = [
+  "google.appengine.ext.db",
+  "google.appengine.api.memcache",
+  "google.appengine.api.users",
+  "google.appengine.ext.webapp",
+  "google.appengine.ext.webapp.template",
+  "models",
+  "common",
+]
+for module_name in STARTUP_MODULES:
+  timed_import(module_name)
+
 from google.appengine.api import memcache
 from google.appengine.ext import webapp
 from google.appengine.ext import db
-from google.appengine.ext.webapp import template
-from django.utils import feedgenerator
-from django.template import Context, Template
-import logging
-from offsets import *
+from common import *
 
 # Structure of urls:
 #
@@ -19,413 +31,76 @@ from offsets import *
 #
 # /manageforums[?forum=<key> - edit/create/disable forums
 #
+# /rsscombined - rss feed for all posts in all forums
+#
 # Per-forum urls
 #
-# /<forum_url>/[?from=<n>]
-#    index, lists of topics, optionally starting from topic <n>
+# /<forum_url>/[?after=<token>]
+#    index, lists of topics, optionally starting after a topic identified by
+#    opaque <token> (as returned in "Older topics" link).
+#    /<forum_url>/?from=<n> (starting from topic <n>) is still supported
 #
 # /<forum_url>/post[?id=<id>]
 #    form for creating a new post. if "topic" is present, it's a post in
 #    existing topic, otherwise a post starting a new topic
 #
-# /<forum_url>/topic?id=<id>&comments=<comments>
+# /<forum_url>/topic?id=<id>&comments=<comments>[&after=<token>]
 #    shows posts in a given topic, 'comments' is ignored (just a trick to re-use
-#    browser's history to see if the topic has posts that user didn't see yet
+#    browser's history to see if the topic has posts that user didn't see yet.
+#    Long topics are split into pages, the next one starts after a post
+#    identified by opaque <token>
+#
+# /<forum_url>/topic?id=<id>&post=<post_id>
+#    redirects to the page of a topic with a given post
 #
 # /<forum_url>/postdel?<post_id>
 # /<forum_url>/postundel?<post_id>
 #    delete/undelete post
 #
+# /<forum_url>/search?q=<words>
+#    topics containing all words, best matches first
+#
+# /<forum_url>/api/topics[?after=<token>]
+# /<forum_url>/api/topic?id=<id>[&after=<token>]
+#    topic list and topic as JSON (or JSONP, with callback=<name>), see
+#    static/fofou_api.js
+#
 # /<forum_url>/rss
 #    rss feed for first post in the topic (default)
 #
 # /<forum_url>/rssall
 #    rss feed for all posts
+#
+# /<forum_url>/maintenance?job=<job>[&after=<key>]
+#    admin only, runs one batch of a maintenance job (e.g. re-rendering posts)
+#
+# /startuptimes
+#    admin only, how long importing each module took in this instance
+#
+# Handlers for feeds, import and admin pages are in their own modules
+# (feeds.py, importer.py, admin.py, search.py, api.py), imported on first request to their urls
 
-# HTTP codes
-HTTP_NOT_ACCEPTABLE = 406
-HTTP_NOT_FOUND = 404
-
-RSS_MEMCACHED_KEY = "rss"
-
-class FofouUser(db.Model):
-  # according to docs UserProperty() cannot be optional, so for anon users
-  # we set it to value returned by anonUser() function
-  # user is uniquely identified by either user property (if not equal to
-  # anonUser()) or cookie
-  user = db.UserProperty()
-  cookie = db.StringProperty()
-  # email, as entered in the post form, can be empty string
-  email = db.StringProperty()
-  # name, as entered in the post form
-  name = db.StringProperty()
-  # homepage - as entered in the post form, can be empty string
-  homepage = db.StringProperty()
-  # value of 'remember_me' checkbox selected during most recent post
-  remember_me = db.BooleanProperty(default=True)
-
-class Forum(db.Model):
-  # Urls for forums are in the form /<urlpart>/<rest>
-  url = db.StringProperty(required=True)
-  # What we show as html <title> and as main header on the page
-  title = db.StringProperty()
-  # a tagline is below title
-  tagline = db.StringProperty()
-  # stuff to display in left sidebar
-  sidebar = db.TextProperty()
-  # if true, forum has been disabled. We don't support deletion so that
-  # forum can always be re-enabled in the future
-  is_disabled = db.BooleanProperty(default=False)
-  # just in case, when the forum was created. Not used.
-  created_on = db.DateTimeProperty(auto_now_add=True)
-  # name of the skin (must be one of SKINS)
-  skin = db.StringProperty()
-  # Google analytics code
-  analytics_code = db.StringProperty()
-  # secret value that needs to be passed in form data
-  # as 'secret' field to /import
-  import_secret = db.StringProperty()
-
-# A forum is collection of topics
-class Topic(db.Model):
-  forum = db.Reference(Forum, required=True)
-  subject = db.StringProperty(required=True)
-  created_on = db.DateTimeProperty(auto_now_add=True)
-  # name of person who created the topic. Duplicates Post.user_name
-  # of the first post in this topic, for speed
-  created_by = db.StringProperty()
-  # just in case, not used
-  updated_on = db.DateTimeProperty(auto_now=True)
-  # True if first Post in this topic is deleted. Updated on deletion/undeletion
-  # of the post
-  is_deleted = db.BooleanProperty(default=False)
-  # ncomments is redundant but is faster than always quering count of Posts
-  ncomments = db.IntegerProperty(default=0)
-
-# A topic is a collection of posts
-class Post(db.Model):
-  topic = db.Reference(Topic, required=True)
-  forum = db.Reference(Forum, required=True)
-  created_on = db.DateTimeProperty(auto_now_add=True)
-  message = db.TextProperty(required=True)
-  sha1_digest = db.StringProperty(required=True)
-  # admin can delete/undelete posts. If first post in a topic is deleted,
-  # that means the topic is deleted as well
-  is_deleted = db.BooleanProperty(default=False)
-  # ip address from which this post has been made
-  user_ip = db.IntegerProperty(required=True)
-  user = db.Reference(FofouUser, required=True)
-  # user_name, user_email and user_homepage might be different than
-  # name/homepage/email fields in user object, since they can be changed in
-  # FofouUser
-  user_name = db.StringProperty()
-  user_email = db.StringProperty()
-  user_homepage = db.StringProperty()
-
-SKINS = ["default"]
-
-# cookie code based on http://code.google.com/p/appengine-utitlies/source/browse/trunk/utilities/session.py
-FOFOU_COOKIE = "fofou-uid"
-COOKIE_EXPIRE_TIME = 60*60*24*120 # valid for 60*60*24*120 seconds => 120 days
-
-def get_user_agent(): return os.environ['HTTP_USER_AGENT']
-def get_remote_ip(): return os.environ['REMOTE_ADDR']
-
-def ip2long(ip):
-  ip_array = ip.split('.')
-  ip_long = int(ip_array[0]) * 16777216 + int(ip_array[1]) * 65536 + int(ip_array[2]) * 256 + int(ip_array[3])
-  return ip_long
-
-def long2ip(val):
-  slist = []
-  for x in range(0,4):
-    slist.append(str(int(val >> (24 - (x * 8)) & 0xFF)))
-  return ".".join(slist)
-
-def to_unicode(val):
-  if isinstance(val, unicode): return val
-  try:
-    return unicode(val, 'latin-1')
-  except:
-    pass
-  try:
-    return unicode(val, 'ascii')
-  except:
-    pass
-  try:
-    return unicode(val, 'utf-8')
-  except:
-    raise
-
-def req_get_vals(req, names, strip=True): 
-  if strip:
-    return [req.get(name).strip() for name in names]
-  else:
-    return [req.get(name) for name in names]
-  
-def get_inbound_cookie():
-  c = Cookie.SimpleCookie()
-  cstr = os.environ.get('HTTP_COOKIE', '')
-  c.load(cstr)
-  return c
-
-def new_user_id():
-  sid = sha.new(repr(time.time())).hexdigest()
-  return sid
-
-def valid_user_cookie(c):
-  # cookie should always be a hex-encoded sha1 checksum
-  if len(c) != 40:
-    return False
-  # TODO: check that user with that cookie exists, the way appengine-utilities does
-  return True
-
-g_fofou_cookie = None
-# returns either a FOFOU_COOKIE sent by the browser or a newly created cookie
-def get_fofou_cookie():
-  global g_fofou_cookie
-  if g_fofou_cookie:
-    return g_fofou_cookie
-  cookies = get_inbound_cookie()
-  for cookieName in cookies.keys():
-    if FOFOU_COOKIE != cookieName:
-      del cookies[cookieName]
-  if (FOFOU_COOKIE not in cookies) or not valid_user_cookie(cookies[FOFOU_COOKIE].value):
-    cookies[FOFOU_COOKIE] = new_user_id()
-    cookies[FOFOU_COOKIE]['path'] = '/'
-    cookies[FOFOU_COOKIE]['expires'] = COOKIE_EXPIRE_TIME
-  g_fofou_cookie = cookies[FOFOU_COOKIE]
-  return g_fofou_cookie
-
-def get_fofou_cookie_val():
-  c = get_fofou_cookie()
-  return c.value
-
-g_fofou_set_cookie = None
-# remember cookie so that we can send it when we render a template
-def send_fofou_cookie():
-  global g_fofou_set_cookie
-  if not g_fofou_set_cookie:
-    g_fofou_set_cookie = get_fofou_cookie()
-
-g_anonUser = None
-def anonUser():
-  global g_anonUser
-  if None == g_anonUser:
-    g_anonUser = users.User("dummy@dummy.address.com")
-  return g_anonUser
-
-def template_out(response, template_name, template_values):
-  response.headers['Content-Type'] = 'text/html'
-  if g_fofou_set_cookie:
-    # a hack extract the cookie part from the whole "Set-Cookie: val" header
-    c = str(g_fofou_set_cookie)
-    c = c.split(": ", 1)[1]
-    response.headers["Set-Cookie"] = c
-  #path = os.path.join(os.path.dirname(__file__), template_name)
-  path = template_name
-  #logging.info("tmpl: %s" % path)
-  res = template.render(path, template_values)
-  response.out.write(res)
-
-def valid_forum_url(url):
-  if not url:
-    return False
-  return url == urllib.quote_plus(url)
-
-# very simplistic check for <txt> being a valid e-mail address
-def valid_email(txt):
-  # allow empty strings
-  if not txt:
-    return True
-  if '@' not in txt:
-    return False
-  if '.' not in txt:
-    return False
-  return True
-
-def forum_from_url(url):
-  assert '/' == url[0]
-  path = url[1:]
-  if '/' in path:
-    (forumurl, rest) = path.split("/", 1)
-  else:
-    forumurl = path
-  return Forum.gql("WHERE url = :1", forumurl).get()
-      
-def forum_root(forum): return "/" + forum.url + "/"
-
-def forum_siteroot_tmpldir_from_url(url):
-  assert '/' == url[0]
-  path = url[1:]
-  if '/' in path:
-    (forumurl, rest) = path.split("/", 1)
-  else:
-    forumurl = path
-  forum = Forum.gql("WHERE url = :1", forumurl).get()
-  if not forum:
-    return (None, None, None)
-  siteroot = forum_root(forum)
-  skin_name = forum.skin
-  if skin_name not in SKINS:
-    skin_name = SKINS[0]
-  tmpldir = os.path.join("skins", skin_name)
-  return (forum, siteroot, tmpldir)
-
-def get_log_in_out(url):
-  user = users.get_current_user()
-  if user:
-    if users.is_current_user_admin():
-      return "Welcome admin, %s! <a href=\"%s\">Log out</a>" % (user.nickname(), users.create_logout_url(url))
-    else:
-      return "Welcome, %s! <a href=\"%s\">Log out</a>" % (user.nickname(), users.create_logout_url(url))
-  else:
-    return "<a href=\"%s\">Log in or register</a>" % users.create_login_url(url)    
-
-# responds to GET /manageforums[?forum=<key>&disable=yes&enable=yes]
-# and POST /manageforums with values from the form
-class ManageForums(webapp.RequestHandler):
-
-  def post(self):
-    if not users.is_current_user_admin():
-      return self.redirect("/")
-
-    forum_key = self.request.get('forum_key')
-    forum = None
-    if forum_key:
-      forum = db.get(db.Key(forum_key))
-      if not forum:
-        # invalid key - should not happen so go to top-level
-        return self.redirect("/")
-
-    vals = ['url','title', 'tagline', 'sidebar', 'disable', 'enable', 'importsecret', 'analyticscode']
-    (url, title, tagline, sidebar, disable, enable, import_secret, analytics_code) = req_get_vals(self.request, vals)
-
-    errmsg = None
-    if not valid_forum_url(url):
-      errmsg = "Url contains illegal characters"
-    if not forum:
-      forum_exists = Forum.gql("WHERE url = :1", url).get()
-      if forum_exists:
-        errmsg = "Forum with this url already exists"
-
-    if errmsg:
-      tvals = {
-        'urlclass' : "error",
-        'hosturl' : self.request.host_url,
-        'prevurl' : url,
-        'prevtitle' : title,
-        'prevtagline' : tagline,
-        'prevsidebar' : sidebar,
-        'previmportsecret' : import_secret,
-        'prevanalyticscode' : analytics_code,
-        'forum_key' : forum_key,
-        'errmsg' : errmsg
-      }
-      return self.render_rest(tvals)
-
-    title_or_url = title or url
-    if forum:
-      # update existing forum
-      forum.url = url
-      forum.title = title
-      forum.tagline = tagline
-      forum.sidebar = sidebar
-      forum.import_secret = import_secret
-      forum.analytics_code = analytics_code
-      forum.put()
-      msg = "Forum '%s' has been updated." % title_or_url
-    else:
-      # create a new forum
-      forum = Forum(url=url, title=title, tagline=tagline, sidebar=sidebar, import_secret = import_secret, analytics_code = analytics_code)
-      forum.put()
-      msg = "Forum '%s' has been created." % title_or_url
-    url = "/manageforums?msg=%s" % urllib.quote(msg)
-    return self.redirect(url)
-
-  def get(self):
-    if not users.is_current_user_admin():
-      return self.redirect("/")
-
-    # if there is 'forum_key' argument, this is editing an existing forum.
-    forum = None
-    forum_key = self.request.get('forum_key')
-    if forum_key:
-      forum = db.get(db.Key(forum_key))
-      if not forum:
-        # invalid forum key - should not happen, return to top level
-        return self.redirect("/")
-
-    tvals = {
-      'hosturl' : self.request.host_url,
-      'forum' : forum
-    }
-    if forum:
-      disable = self.request.get('disable')
-      enable = self.request.get('enable')
-      if disable or enable:
-        title_or_url = forum.title or forum.url
-        if disable:
-          forum.is_disabled = True
-          forum.put()
-          msg = "Forum %s has been disabled." % title_or_url
-        else:
-          forum.is_disabled = False
-          forum.put()
-          msg = "Forum %s has been enabled." % title_or_url
-        return self.redirect("/manageforums?msg=%s" % urllib.quote(msg))
-    self.render_rest(tvals, forum)
-
-  def render_rest(self, tvals, forum=None):
-    user = users.get_current_user()
-    forumsq = db.GqlQuery("SELECT * FROM Forum")
-    forums = []
-    for f in forumsq:
-      edit_url = "/manageforums?forum_key=" + str(f.key())
-      if f.is_disabled:
-        f.enable_disable_txt = "enable"
-        f.enable_disable_url = edit_url + "&enable=yes"
-      else:
-        f.enable_disable_txt = "disable"
-        f.enable_disable_url = edit_url + "&disable=yes"      
-      if forum and f.key() == forum.key():
-        # editing existing forum
-        f.no_edit_link = True
-        tvals['prevurl'] = f.url
-        tvals['prevtitle'] = f.title
-        tvals['prevtagline'] = f.tagline
-        tvals['prevsidebar'] = f.sidebar
-        tvals['previmportsecret'] = f.import_secret
-        tvals['prevanalyticscode'] = f.analytics_code
-        tvals['forum_key'] = str(f.key())
-      forums.append(f)
-    tvals['msg'] = self.request.get('msg')
-    tvals['user'] = user
-    tvals['forums'] = forums
-    template_out(self.response, "manage_forums.html", tvals)
 
 # responds to /, shows list of available forums or redirects to
 # forum management page if user is admin
-class ForumList(webapp.RequestHandler):
+class ForumList(FofouHandler):
   def get(self):
-    if users.is_current_user_admin():
+    if self.ctx.is_admin:
       return self.redirect("/manageforums")
-    MAX_FORUMS = 256 # if you need more, tough
-    forums = db.GqlQuery("SELECT * FROM Forum").fetch(MAX_FORUMS)
     tvals = {
-      'forums' : forums,
-      'isadmin' : users.is_current_user_admin(),
-      'log_in_out' : get_log_in_out("/")
+      'forums' : get_forums(),
+      'isadmin' : self.ctx.is_admin,
+      'log_in_out' : get_log_in_out(self.ctx, "/")
     }
     template_out(self.response, "forum_list.html", tvals)
 
 # responds to GET /postdel?<post_id> and /postundel?<post_id>
-class PostDelUndel(webapp.RequestHandler):
+class PostDelUndel(FofouHandler):
   def get(self):
     (forum, siteroot, tmpldir) = forum_siteroot_tmpldir_from_url(self.request.path_info)
     if not forum or forum.is_disabled:
       return self.redirect("/")
-    is_moderator = users.is_current_user_admin()
+    is_moderator = self.ctx.is_admin
     if not is_moderator or forum.is_disabled:
       return self.redirect(siteroot)
     post_id = self.request.query_string
@@ -439,154 +114,125 @@ class PostDelUndel(webapp.RequestHandler):
       return self.redirect(siteroot)
     path = self.request.path
     if path.endswith("/postdel"):
-      if not post.is_deleted:
-        post.is_deleted = True
-        post.put()
-        memcache.delete(RSS_MEMCACHED_KEY)
-      else:
-        logging.info("Post '%s' is already deleted" % post_id)
+      is_deleted = True
     elif path.endswith("/postundel"):
-      if post.is_deleted:
-        post.is_deleted = False
-        post.put()
-        memcache.delete(RSS_MEMCACHED_KEY)
-      else:
-        logging.info("Trying to undelete post '%s' that is not deleted" % post_id)
+      is_deleted = False
     else:
       logging.info("'%s' is not a valid path" % path)
+      return self.redirect(siteroot)
 
     topic = post.topic
-    # deleting/undeleting first post also means deleting/undeleting the whole topic
-    first_post = Post.gql("WHERE forum=:1 AND topic = :2 ORDER BY created_on", forum, topic).get()
-    if first_post.key() == post.key():
-      if path.endswith("/postdel"):
-        topic.is_deleted = True
+    if post.is_deleted == is_deleted:
+      if is_deleted:
+        logging.info("Post '%s' is already deleted" % post_id)
       else:
-        topic.is_deleted = False
-      topic.put()
+        logging.info("Trying to undelete post '%s' that is not deleted" % post_id)
+    else:
+      post.is_deleted = is_deleted
+      post.put()
+      delta = 1
+      if is_deleted:
+        delta = -1
+      incr_forum_counter(forum, "posts", delta)
+      # deleting/undeleting first post also means deleting/undeleting the whole topic
+      is_first_post = (topic.first_post_key() == post.key())
+      last_post = topic.query_last_post()
+      def update(topic):
+        if is_first_post:
+          topic.is_deleted = is_deleted
+        else:
+          topic.ncomments = max(0, topic.ncomments + delta)
+        topic.set_last_post(last_post)
+      topic = update_topic(topic.key(), update)
+      if is_first_post:
+        incr_forum_counter(forum, "topics", delta)
+        if is_deleted:
+          delete_topic_index(topic)
+        else:
+          reindex_topic(topic)
+      elif not topic.is_deleted:
+        update_topic_index(topic, post, delta)
+      delete_topic_snapshots(topic.key().id())
+      invalidate_feeds(forum)
+      invalidate_topic_list(forum)
 
     # redirect to topic owning this post
     topic_url = siteroot + "topic?id=" + str(topic.key().id())
     self.redirect(topic_url)
     
-# responds to /<forumurl>/[?from=<from>]
-# shows a list of topics, potentially starting from topic N
-class TopicList(webapp.RequestHandler):
+# responds to /<forumurl>/[?after=<token>] and /<forumurl>/[?from=<from>]
+# shows a list of topics, potentially starting after a given topic
+class TopicList(FofouHandler):
 
-  def get_topics(self, forum, is_moderator, start, max_topics):
+  # legacy offset-based paging for /<forumurl>/?from=<n> urls
+  def get_topics_from(self, forum, is_moderator, start, max_topics):
     if is_moderator:
-      topics = Topic.gql("WHERE forum = :1 ORDER BY created_on DESC", forum).fetch(max_topics, start)
+      topics = Topic.gql("WHERE forum = :1 ORDER BY created_on DESC", forum).fetch(max_topics + 1, start)
     else:
-      topics = Topic.gql("WHERE forum = :1 AND is_deleted = False ORDER BY created_on DESC", forum).fetch(max_topics, start)
+      topics = Topic.gql("WHERE forum = :1 AND is_deleted = False ORDER BY created_on DESC", forum).fetch(max_topics + 1, start)
     if 0 == len(topics) and start > 0:
-      return self.get_topics(forum, is_moderator, 0, max_topics)
-    return (start, topics)
+      return self.get_topics_from(forum, is_moderator, 0, max_topics)
+    return (start, topics[:max_topics], len(topics) > max_topics)
 
   def get(self):
     (forum, siteroot, tmpldir) = forum_siteroot_tmpldir_from_url(self.request.path_info)
     if not forum or forum.is_disabled:
       return self.redirect("/")
-    start = 0
-    if self.request.get("from"):
-      start = int(self.request.get("from"))
-    is_moderator = users.is_current_user_admin()
-    MAX_TOPICS = 75
-    (start, topics) = self.get_topics(forum, is_moderator, start, MAX_TOPICS)
-    new_start = 0
-    if len(topics) == MAX_TOPICS:
-      new_start = start + MAX_TOPICS
+    is_moderator = self.ctx.is_admin
+    (after_token, start_from) = (self.request.get("after"), self.request.get("from"))
+    # normalize so that garbage in the url doesn't create new cache entries
+    if not decode_page_token(after_token):
+      after_token = ""
+    if not start_from.isdigit():
+      start_from = ""
+    key = topic_list_memcached_key(forum, is_moderator, after_token, start_from)
+    cached = memcache.get(key)
+    if cached is None:
+      html = self.render_topics(forum, siteroot, tmpldir, is_moderator, after_token, start_from)
+      if html is None:
+        return self.redirect(siteroot)
+      if isinstance(html, unicode):
+        html = html.encode('utf-8')
+      cached = (html, deflate_parts(html))
+      memcache.set(key, cached)
+    (html, deflated_parts) = cached
+    cached_html_out(self.request, self.response, html, deflated_parts, get_log_in_out(self.ctx, siteroot))
+
+  # returns rendered page, with LOG_IN_OUT_PLACEHOLDER instead of log in/out
+  # links, or None if the page is past the last topic
+  def render_topics(self, forum, siteroot, tmpldir, is_moderator, after_token, start_from):
+    after = decode_page_token(after_token)
+    if after:
+      start = after[2]
+      (topics, has_more) = get_topics_page(forum, is_moderator, after)
+      if 0 == len(topics):
+        return None
+    elif start_from:
+      start = int(start_from)
+      (start, topics, has_more) = self.get_topics_from(forum, is_moderator, start, TOPICS_PER_PAGE)
+    else:
+      start = 0
+      (topics, has_more) = get_topics_page(forum, is_moderator, None)
+    next_page = None
+    if has_more:
+      next_page = encode_page_token(topics[-1], start + len(topics))
     tvals = {
       'siteroot' : siteroot,
-      'siteurl' : self.request.url,
       'forum' : forum,
       'topics' : topics,
       'analytics_code' : forum.analytics_code or "",
       'from' : start,
       'to' : start + len(topics),
-      'new_from' : new_start,
-      'log_in_out' : get_log_in_out(siteroot)
+      'next_page' : next_page,
+      'ntopics' : get_forum_counter(forum, "topics"),
+      'nposts' : get_forum_counter(forum, "posts"),
+      'log_in_out' : LOG_IN_OUT_PLACEHOLDER
     }
     tmpl = os.path.join(tmpldir, "topic_list.html")
-    template_out(self.response, tmpl, tvals)
-
-# responds to /<forumurl>/importfruitshow
-class ImportFruitshow(webapp.RequestHandler):
-
-  def post(self):
-    (forum, siteroot, tmpldir) = forum_siteroot_tmpldir_from_url(self.request.path_info)
-    if not forum or forum.is_disabled:
-      return self.error(HTTP_NOT_ACCEPTABLE)
-    # not active at all if not protected by secret
-    if not forum.import_secret:
-      logging.info("tried to import topic into '%s' forum, but forum has no import_secret" % forum.url)
-      return self.error(HTTP_NOT_ACCEPTABLE)
-    (topic_pickled, import_secret) = req_get_vals(self.request, ["topicdata", 'importsecret'], strip=False)
-    if not topic_pickled:
-      logging.info("tried to import topic into '%s' forum, but no 'topicdata' field" % forum.url)
-      return self.error(HTTP_NOT_ACCEPTABLE)
-    if import_secret != forum.import_secret:
-        logging.info("tried to import topic into '%s' forum, but import_secret doesn't match" % forum.url)
-        return self.error(HTTP_NOT_ACCEPTABLE)
-      
-    fo = StringIO.StringIO(topic_pickled)
-    topic_data = pickle.load(fo)
-    fo.close()
-
-    (topic, posts) = topic_data
-    topic_no = topic[TOPIC_ID]
-    if 0 == len(posts):
-      logging.info("There are no posts in this topic.")
-      return self.error(HTTP_NOT_ACCEPTABLE)
-
-    subject = to_unicode(topic[TOPIC_SUBJECT])
-    first_post = posts[0]
-    last_post = posts[-1]
-    created_on = first_post[POST_POSTED_ON]
-    #logging.info("subject: %s, created_on: %s" % (subject, str(created_on)))
-    topic = Topic.gql("WHERE forum = :1 AND subject = :2 AND created_on = :3", forum, subject, created_on).get()
-    if topic:
-      logging.info("topic already exists, subject: %s, created_on: %s" % (subject, str(created_on)))
-      return self.error(HTTP_NOT_ACCEPTABLE)
-    created_by = to_unicode(first_post[POST_NAME])
-    topic = Topic(forum=forum, subject=subject, created_on=created_on, created_by=created_by, updated_on = created_on)
-    topic.ncomments = len(posts)-1
-    topic.updated_on = last_post[POST_POSTED_ON]
-    topic.is_deleted = bool(int(first_post[POST_DELETED]))
-    topic.put()
-    #logging.info("created topic, subject: %s, created_on: %s" % (subject, str(created_on)))
-    for post in posts:
-      body = to_unicode(post[POST_MSG])
-      name = to_unicode(post[POST_NAME])
-      email = post[POST_EMAIL]
-      homepage = post[POST_URL]
-      (name, email, homepage) = (name.strip(), email.strip(), homepage.strip())
-      if len(homepage) <= len("http://"):
-        homepage = ""
-      created_on = post[POST_POSTED_ON]
-      # this is already an integer, not string
-      user_ip = post[POST_POSTER_IP]
-      is_deleted = bool(int(post[POST_DELETED]))
-      user = FofouUser.gql("WHERE name = :1 AND email = :2 AND homepage = :3", name, email, homepage).get()
-      if not user:
-        #logging.info("Didn't find user for name='%s', email='%s', homepage='%s'. Creating one." % (name, email, homepage))
-        cookie = new_user_id()
-        user = FofouUser(cookie=cookie, name=name, email=email, homepage=homepage)
-        user.put()
-
-      # sha.new() doesn't accept Unicode strings, so convert to utf8 first
-      body_utf8 = body.encode('UTF-8')
-      s = sha.new(body_utf8)
-      sha1_digest = s.hexdigest()
-      new_post = Post(topic=topic, forum=forum, created_on=created_on, message=body, sha1_digest=sha1_digest, is_deleted=is_deleted, user_ip=user_ip, user=user)
-      new_post.user_name = name
-      new_post.user_email = email
-      new_post.user_homepage = homepage
-      new_post.put()
-      logging.info("Imported post %s" % str(post[POST_ID]))
-    logging.info("Imported topic %s" % str(topic_no))
+    return template_render(tmpl, tvals)
 
 # responds to /<forumurl>/topic?id=<id>
-class TopicForm(webapp.RequestHandler):
+class TopicForm(FofouHandler):
 
   def get(self):
     (forum, siteroot, tmpldir) = forum_siteroot_tmpldir_from_url(self.request.path_info)
@@ -594,31 +240,59 @@ class TopicForm(webapp.RequestHandler):
       return self.redirect("/")
 
     topic_id = self.request.get('id')
-    if not topic_id:
+    if not topic_id.isdigit():
       return self.redirect(siteroot)
 
+    is_moderator = self.ctx.is_admin
+    post_id = self.request.get('post')
+    if post_id.isdigit():
+      return self.redirect_to_post(forum, siteroot, int(topic_id), int(post_id), is_moderator)
+
+    after_token = self.request.get('after')
+    after = decode_page_token(after_token)
+    if not after:
+      after_token = ""
+
+    log_in_out = get_log_in_out(self.ctx, self.request.url)
+    # archived topics are served from a snapshot, without reading the topic
+    # and its posts
+    skin = os.path.basename(tmpldir)
+    page_no = topic_snapshot_page_no(after)
+    snapshot = None
+    if page_no is not None:
+      snapshot = get_topic_snapshot(topic_snapshot_key_name(int(topic_id), skin, is_moderator, page_no), forum)
+    if snapshot and snapshot.page_token == after_token:
+      etag = self.page_etag(snapshot.etag, True, log_in_out)
+      return cached_html_out(self.request, self.response, snapshot.html, snapshot.gzip_parts, log_in_out, etag, snapshot.last_modified)
+
     topic = db.get(db.Key.from_path('Topic', int(topic_id)))
     if not topic:
       return self.redirect(siteroot)
 
-    is_moderator = users.is_current_user_admin()
     if topic.is_deleted and not is_moderator:
       return self.redirect(siteroot)
 
-    is_archived = False
-    now = datetime.datetime.now()
-    week = datetime.timedelta(days=7)
-    #week = datetime.timedelta(seconds=7)
-    if now > topic.created_on + week:
-      is_archived = True
-
-    # 200 is more than generous
-    MAX_POSTS = 200
-    if is_moderator:
-      posts = Post.gql("WHERE forum = :1 AND topic = :2 ORDER BY created_on", forum, topic).fetch(MAX_POSTS)
-    else:
-      posts = Post.gql("WHERE forum = :1 AND topic = :2 AND is_deleted = False ORDER BY created_on", forum, topic).fetch(MAX_POSTS)
+    is_archived = is_topic_archived(topic)
+    # the page only changes when the topic does (see topic_etag()), except
+    # for things that depend on who's looking at it
+    etag = topic_etag(topic, u"%s:%d:%d:%s:%s" % (tmpldir, is_moderator, is_archived, forum_fingerprint(forum), after_token))
+    last_modified = datetime_to_usec(topic.updated_on) / 1000000
+    if not_modified(self.request, self.response, self.page_etag(etag, is_archived, log_in_out), last_modified):
+      return
 
+    (posts, has_more) = get_topic_posts(forum, topic, is_moderator, after)
+    if after and not posts:
+      return self.redirect(siteroot + "topic?id=" + topic_id)
+    # position of pages linked to from permalinks isn't known
+    start = 0
+    if after:
+      start = after[2]
+    (post_from, post_to) = (None, None)
+    if start >= 0:
+      (post_from, post_to) = (start + 1, start + len(posts))
+    next_page = None
+    if has_more:
+      next_page = next_page_token(posts, after)
     tvals = {
       'siteroot' : siteroot,
       'forum' : forum,
@@ -627,108 +301,65 @@ class TopicForm(webapp.RequestHandler):
       'is_moderator' : is_moderator,
       'is_archived' : is_archived,
       'posts' : posts,
-      'log_in_out' : get_log_in_out(self.request.url),
+      'page' : after_token,
+      'next_page' : next_page,
+      'from' : post_from,
+      'to' : post_to,
+      'log_in_out' : log_in_out,
     }
     tmpl = os.path.join(tmpldir, "topic.html")
-    template_out(self.response, tmpl, tvals)
-
-# responds to /<forumurl>/rss, returns an RSS feed of recent topics
-# (taking into account only the first post in a topic - that's what
-# joelonsoftware forum rss feed does)
-class RssFeed(webapp.RequestHandler):
-
-  def get(self):
-    (forum, siteroot, tmpldir) = forum_siteroot_tmpldir_from_url(self.request.path_info)
-    if not forum or forum.is_disabled:
-      return self.error(HTTP_NOT_FOUND)
-
-    cached_feed = memcache.get(RSS_MEMCACHED_KEY)
-    if cached_feed is not None:
-      self.response.headers['Content-Type'] = 'text/xml'
-      self.response.out.write(cached_feed)
-      return
-      
-    feed = feedgenerator.Atom1Feed(
-      title = forum.title or forum.url,
-      link = siteroot + "rss",
-      description = forum.tagline)
-  
-    topics = Topic.gql("WHERE forum = :1 AND is_deleted = False ORDER BY created_on DESC", forum).fetch(25)
-    for topic in topics:
-      title = topic.subject
-      link = siteroot + "topic?id=" + str(topic.key().id())
-      first_post = Post.gql("WHERE topic = :1 ORDER BY created_on", topic).get()
-      msg = first_post.message
-      # TODO: a hack: using a full template to format message body.
-      # There must be a way to do it using straight django APIs
-      name = topic.created_by
-      if name:
-        t = Template("<strong>{{ name }}</strong>: {{ msg|striptags|escape|urlize|linebreaksbr }}")
-      else:
-        t = Template("{{ msg|striptags|escape|urlize|linebreaksbr }}")
-      c = Context({"msg": msg, "name" : name})
-      description = t.render(c)
-      pubdate = topic.created_on
-      feed.add_item(title=title, link=link, description=description, pubdate=pubdate)
-    feedtxt = feed.writeString('utf-8')
-    self.response.headers['Content-Type'] = 'text/xml'
-    self.response.out.write(feedtxt)
-    memcache.add(RSS_MEMCACHED_KEY, feedtxt)
-
-# responds to /<forumurl>/rssall, returns an RSS feed of all recent posts
-# This is good for forum admins/moderators who want to monitor all posts
-class RssAllFeed(webapp.RequestHandler):
-
-  def get(self):
-    (forum, siteroot, tmpldir) = forum_siteroot_tmpldir_from_url(self.request.path_info)
-    if not forum or forum.is_disabled:
-      return self.error(HTTP_NOT_FOUND)
-
-    feed = feedgenerator.Atom1Feed(
-      title = forum.title or forum.url,
-      link = siteroot + "rssall",
-      description = forum.tagline)
-  
-    posts = Post.gql("WHERE forum = :1 AND is_deleted = False ORDER BY created_on DESC", forum).fetch(25)
-    for post in posts:
-      topic = post.topic
-      title = topic.subject
-      link = siteroot + "topic?id=" + str(topic.key().id())
-      msg = post.message
-      # TODO: a hack: using a full template to format message body.
-      # There must be a way to do it using straight django APIs
-      name = post.user_name
-      if name:
-        t = Template("<strong>{{ name }}</strong>: {{ msg|striptags|escape|urlize|linebreaksbr }}")
-      else:
-        t = Template("{{ msg|striptags|escape|urlize|linebreaksbr }}")
-      c = Context({"msg": msg, "name" : name})
-      description = t.render(c)
-      pubdate = post.created_on
-      feed.add_item(title=title, link=link, description=description, pubdate=pubdate)
-    feedtxt = feed.writeString('utf-8')
-    self.response.headers['Content-Type'] = 'text/xml'
-    self.response.out.write(feedtxt)
-
-def get_fofou_user():
-  # get user either by google user id or cookie
-  user_id = users.get_current_user()
-  user = None
-  if user_id:
-    user = FofouUser.gql("WHERE user = :1", user_id).get()
-    #if user: logging.info("Found existing user for by user_id '%s'" % str(user_id))
-  else:
-    cookie = get_fofou_cookie_val()
-    if cookie:
-      user = FofouUser.gql("WHERE cookie = :1", cookie).get()
-      #if user:
-      #  logging.info("Found existing user for cookie '%s'" % cookie)
-      #else:
-      #  logging.info("Didn't find user for cookie '%s'" % cookie)
-  return user
+    if not is_archived or not self.is_snapshot_page(forum, int(topic_id), skin, is_moderator, page_no, after_token):
+      return template_out(self.response, tmpl, tvals)
+    tvals['log_in_out'] = LOG_IN_OUT_PLACEHOLDER
+    html = template_render(tmpl, tvals)
+    snapshot_key_name = topic_snapshot_key_name(topic.key().id(), skin, is_moderator, page_no)
+    snapshot = save_topic_snapshot(snapshot_key_name, forum, topic.key().id(), after_token, next_page, html, etag, last_modified)
+    # etag is checked again, as the gzip version has a different one
+    cached_html_out(self.request, self.response, snapshot.html, snapshot.gzip_parts, log_in_out, self.page_etag(etag, True, log_in_out), last_modified)
+
+  # only the first page and pages linked from the previous page's snapshot
+  # are snapshotted, other page tokens are rendered every time
+  def is_snapshot_page(self, forum, topic_id, skin, is_moderator, page_no, page_token):
+    if page_no is None:
+      return False
+    if 0 == page_no:
+      return True
+    prev = get_topic_snapshot(topic_snapshot_key_name(topic_id, skin, is_moderator, page_no - 1), forum)
+    return prev is not None and prev.next_page == page_token
+
+  # topic?id=<id>&post=<post id> redirects to the page with a given post.
+  # Links to posts used to be topic?id=<id>#<post id> and are sent here by
+  # javascript on the first page if the post isn't on it
+  def redirect_to_post(self, forum, siteroot, topic_id, post_id, is_moderator):
+    topic_url = siteroot + "topic?id=" + str(topic_id)
+    post = db.get(db.Key.from_path('Post', post_id))
+    if not post or Post.topic.get_value_for_datastore(post).id() != topic_id or Post.forum.get_value_for_datastore(post) != forum.key():
+      return self.redirect(topic_url)
+    # no #<post id> for posts that won't be shown, so that javascript
+    # doesn't come back here
+    if post.is_deleted and not is_moderator:
+      return self.redirect(topic_url)
+    topic = post.topic
+    if topic.is_deleted and not is_moderator:
+      return self.redirect(siteroot)
+    page_token = topic_page_token_of_post(forum, topic, post, is_moderator)
+    if page_token:
+      topic_url += "&after=" + page_token
+    self.redirect(topic_url + "#" + str(post_id))
+
+  # sets caching headers and returns etag of the page, given etag without
+  # log in/out links
+  def page_etag(self, etag, is_archived, log_in_out):
+    max_age = LIVE_MAX_AGE
+    if is_archived:
+      max_age = ARCHIVED_MAX_AGE
+    # log in/out links depend on the login cookie
+    add_vary(self.response, 'Cookie')
+    set_cache_control(self.response, max_age, self.ctx.user is not None)
+    return '"%s"' % sha.new(etag + log_in_out.encode('utf-8')).hexdigest()
 
 # responds to /<forumurl>/email[?post_id=<post_id>]
-class EmailForm(webapp.RequestHandler):
+class EmailForm(FofouHandler):
 
   def get(self):
     (forum, siteroot, tmpldir) = forum_siteroot_tmpldir_from_url(self.request.path_info)
@@ -750,7 +381,7 @@ class EmailForm(webapp.RequestHandler):
       'post_id' : post_id,
       'to' : to_name,
       'subject' : subject,
-      'log_in_out' : get_log_in_out(siteroot + "post")
+      'log_in_out' : get_log_in_out(self.ctx, siteroot + "post")
     }
     tmpl = os.path.join(tmpldir, "email.html")
     template_out(self.response, tmpl, tvals)
@@ -770,25 +401,25 @@ class EmailForm(webapp.RequestHandler):
       'siteroot' : siteroot,
       'forum' : forum,
       'topic' : topic,
-      'log_in_out' : get_log_in_out(siteroot + "post")
+      'log_in_out' : get_log_in_out(self.ctx, siteroot + "post")
     }    
     tmpl = os.path.join(tmpldir, "email_sent.html")
     template_out(self.response, tmpl, tvals)
 
 # responds to /<forumurl>/post[?id=<topic_id>]
-class PostForm(webapp.RequestHandler):
+class PostForm(FofouHandler):
 
   def get(self):
     (forum, siteroot, tmpldir) = forum_siteroot_tmpldir_from_url(self.request.path_info)
     if not forum or forum.is_disabled:
       return self.redirect("/")
-    send_fofou_cookie()
+    send_fofou_cookie(self.ctx)
 
     rememberChecked = ""
     prevUrl = "http://"
     prevEmail = ""
     prevName = ""
-    user = get_fofou_user()
+    user = get_fofou_user(self.ctx)
     if user and user.remember_me:
       rememberChecked = "checked"
       prevUrl = user.homepage
@@ -807,7 +438,7 @@ class PostForm(webapp.RequestHandler):
       'prevUrl' : prevUrl,
       'prevEmail' : prevEmail,
       'prevName' : prevName,
-      'log_in_out' : get_log_in_out(self.request.url)
+      'log_in_out' : get_log_in_out(self.ctx, self.request.url)
     }
     topic_id = self.request.get('id')
     if topic_id:
@@ -824,11 +455,19 @@ class PostForm(webapp.RequestHandler):
       return self.redirect("/")
     if self.request.get('Cancel'): self.redirect(siteroot)
 
-    send_fofou_cookie()
+    send_fofou_cookie(self.ctx)
 
     vals = ['TopicId', 'num1', 'num2', 'Captcha', 'Subject', 'Message', 'Remember', 'Email', 'Name', 'Url']
     (topic_id, num1, num2, captcha, subject, message, remember_me, email, name, homepage) = req_get_vals(self.request, vals)
     message = to_unicode(message)
+    # a reply must be to an existing topic in this forum, checked before
+    # the post, its digest and the topic are written
+    if topic_id:
+      if not topic_id.isdigit():
+        return self.redirect(siteroot)
+      topic = db.get(db.Key.from_path('Topic', int(topic_id)))
+      if not topic or Topic.forum.get_value_for_datastore(topic) != forum.key():
+        return self.redirect(siteroot)
 
     remember_me = True
     if remember_me == "": remember_me = False
@@ -857,7 +496,7 @@ class PostForm(webapp.RequestHandler):
       "prevUrl" : homepage,
       "prevName" : name,
       "prevTopicId" : topic_id,
-      "log_in_out" : get_log_in_out(siteroot + "post")
+      "log_in_out" : get_log_in_out(self.ctx, siteroot + "post")
     }
 
     # 'http://' is the default value we put, so if unchanged, consider it
@@ -878,8 +517,11 @@ class PostForm(webapp.RequestHandler):
     s = sha.new(message_utf8)
     sha1_digest = s.hexdigest()
 
-    duppost = Post.gql("WHERE sha1_digest = :1", sha1_digest).get()
-    if duppost: errclass = "message_class"
+    duppost = find_duplicate(forum, sha1_digest)
+    if duppost:
+      errclass = "message_class"
+      duppost.nrepeats += 1
+      duppost.put()
 
     if errclass:
       tvals[errclass] = "error"
@@ -888,29 +530,18 @@ class PostForm(webapp.RequestHandler):
 
     # get user either by google user id or cookie. Create user objects if don't
     # already exist
-    existing_user = False
-    user_id = users.get_current_user()
-    if user_id:
-      user = FofouUser.gql("WHERE user = :1", user_id).get()
-      if not user:
+    user = get_fofou_user(self.ctx)
+    if not user:
+      user_id = self.ctx.user
+      if user_id:
         #logging.info("Creating new user for '%s'" % str(user_id))
         user = FofouUser(user=user_id, remember_me = remember_me, email=email, name=name, homepage=homepage)
-        user.put()
       else:
-        existing_user = True
-        #logging.info("Found existing user for '%s'" % str(user_id))
-    else:
-      cookie = get_fofou_cookie_val()
-      user = FofouUser.gql("WHERE cookie = :1", cookie).get()
-      if not user:
+        cookie = get_fofou_cookie_val(self.ctx)
         #logging.info("Creating new user for cookie '%s'" % cookie)
-        user = FofouUser(cookie=cookie, remember_me = remember_me, email=email, name=name, homepage=homepage)
-        user.put()
-      else:
-        existing_user = True
-        #logging.info("Found existing user for cookie '%s'" % cookie)
-
-    if existing_user:
+        user = FofouUser(key_name=anon_user_key_name(cookie), cookie=cookie, remember_me = remember_me, email=email, name=name, homepage=homepage)
+      save_fofou_user(user)
+    else:
       need_update = False
       if user.remember_me != remember_me:
         user.remember_me = remember_me
@@ -926,40 +557,75 @@ class PostForm(webapp.RequestHandler):
         need_update = True
       if need_update:
         #logging.info("User needed an update")
-        user.put()
+        save_fofou_user(user)
 
     if not topic_id:
       topic = Topic(forum=forum, subject=subject, created_by=name)
       topic.put()
+      topic_key = topic.key()
     else:
-      topic = db.get(db.Key.from_path('Topic', int(topic_id)))
-      #assert forum.key() == topic.forum.key()
-      topic.ncomments += 1
-      topic.put()
+      topic_key = db.Key.from_path('Topic', int(topic_id))
 
-    user_ip = ip2long(get_remote_ip())
-    p = Post(topic=topic, forum=forum, user=user, user_ip=user_ip, message=message, sha1_digest=sha1_digest, user_name = name, user_email = email, user_homepage = homepage)
+    user_ip = ip2long(get_remote_ip(self.request))
+    p = Post(topic=topic_key, forum=forum, user=user, user_ip=user_ip, message=message, sha1_digest=sha1_digest, user_name = name, user_email = email, user_homepage = homepage)
+    p.render_html()
     p.put()
-    memcache.delete(RSS_MEMCACHED_KEY)
+    save_post_digest(forum, p)
+    add_to_digest_bloom(forum, [sha1_digest])
+    if not topic_id:
+      topic.set_first_post(p)
+      topic.set_last_post(p)
+      topic.put()
+      incr_forum_counter(forum, "topics", 1)
+    else:
+      def add_reply(topic):
+        #assert forum.key() == topic.forum.key()
+        topic.ncomments += 1
+        topic.set_last_post(p)
+      topic = update_topic(topic_key, add_reply)
+      # replies to archived topics aren't offered, but aren't prevented either
+      if is_topic_archived(topic):
+        delete_topic_snapshots(topic.key().id())
+    if not topic.is_deleted:
+      update_topic_index(topic, p, 1)
+    incr_forum_counter(forum, "posts", 1)
+    invalidate_feeds(forum)
+    invalidate_topic_list(forum)
     if topic_id:
-      self.redirect(siteroot + "topic?id=" + str(topic_id))
+      # the reply can be on any page of a long topic
+      self.redirect(siteroot + "topic?id=%s&post=%d" % (topic_id, p.key().id()))
     else:
       self.redirect(siteroot)
 
+# WSGI application. Per-request state, including the logged in user and
+# whether it's an admin (read from the request's environment, not from
+# os.environ), is kept in handler instances (see RequestContext) and caches
+# in module globals are shared by design, so the same application can serve
+# concurrent requests under a multi-threaded WSGI server. App Engine runs
+# main() for each request (see app.yaml)
+application = FofouApplication(
+   [  ('/', ForumList),
+      ('/manageforums', lazy_handler("admin", "ManageForums")),
+      ('/startuptimes', lazy_handler("admin", "StartupTimes")),
+      ('/rsscombined', lazy_handler("feeds", "RssCombinedFeed")),
+      ('/[^/]+/postdel', PostDelUndel),
+      ('/[^/]+/postundel', PostDelUndel),
+      ('/[^/]+/post', PostForm),
+      ('/[^/]+/topic', TopicForm),
+      ('/[^/]+/email', EmailForm),
+      ('/[^/]+/search', lazy_handler("search", "SearchForm")),
+      ('/[^/]+/api/topics', lazy_handler("api", "ApiTopics")),
+      ('/[^/]+/api/topic', lazy_handler("api", "ApiTopic")),
+      ('/[^/]+/rss', lazy_handler("feeds", "RssFeed")),
+      ('/[^/]+/rssall', lazy_handler("feeds", "RssAllFeed")),
+      ('/[^/]+/importfruitshow', lazy_handler("importer", "ImportFruitshow")),
+      ('/[^/]+/maintenance', lazy_handler("admin", "Maintenance")),
+      ('/[^/]+/?', TopicList)],
+   debug=True)
+
+startup.log_startup_times()
+
 def main():
-  application = webapp.WSGIApplication(
-     [  ('/', ForumList),
-        ('/manageforums', ManageForums),
-        ('/[^/]+/postdel', PostDelUndel),
-        ('/[^/]+/postundel', PostDelUndel),
-        ('/[^/]+/post', PostForm),
-        ('/[^/]+/topic', TopicForm),
-        ('/[^/]+/email', EmailForm),
-        ('/[^/]+/rss', RssFeed),
-        ('/[^/]+/rssall', RssAllFeed),
-        ('/[^/]+/importfruitshow', ImportFruitshow),
-        ('/[^/]+/?', TopicList)],
-     debug=True)
   wsgiref.handlers.CGIHandler().run(application)
 
 if __name__ == "__main__":
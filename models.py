@@ -0,0 +1,228 @@
+# This code is in Public Domain. Take all the code you want, we'll just write more.
+from google.appengine.ext import db
+# webapp's template module sets up django, it must be imported before any
+# other django module
+from google.appengine.ext.webapp import template
+from django.template.defaultfilters import striptags, escape, urlize, linebreaksbr
+
+class FofouUser(db.Model):
+  # according to docs UserProperty() cannot be optional, so for anon users
+  # we set it to value returned by anonUser() function
+  # user is uniquely identified by either user property (if not equal to
+  # anonUser()) or cookie
+  user = db.UserProperty()
+  cookie = db.StringProperty()
+  # email, as entered in the post form, can be empty string
+  email = db.StringProperty()
+  # name, as entered in the post form
+  name = db.StringProperty()
+  # homepage - as entered in the post form, can be empty string
+  homepage = db.StringProperty()
+  # value of 'remember_me' checkbox selected during most recent post
+  remember_me = db.BooleanProperty(default=True)
+
+class Forum(db.Model):
+  # Urls for forums are in the form /<urlpart>/<rest>
+  url = db.StringProperty(required=True)
+  # What we show as html <title> and as main header on the page
+  title = db.StringProperty()
+  # a tagline is below title
+  tagline = db.StringProperty()
+  # stuff to display in left sidebar
+  sidebar = db.TextProperty()
+  # if true, forum has been disabled. We don't support deletion so that
+  # forum can always be re-enabled in the future
+  is_disabled = db.BooleanProperty(default=False)
+  # just in case, when the forum was created. Not used.
+  created_on = db.DateTimeProperty(auto_now_add=True)
+  # name of the skin (must be one of SKINS)
+  skin = db.StringProperty()
+  # Google analytics code
+  analytics_code = db.StringProperty()
+  # secret value that needs to be passed in form data
+  # as 'secret' field to /import
+  import_secret = db.StringProperty()
+
+# A forum is collection of topics
+class Topic(db.Model):
+  forum = db.Reference(Forum, required=True)
+  subject = db.StringProperty(required=True)
+  created_on = db.DateTimeProperty(auto_now_add=True)
+  # name of person who created the topic. Duplicates Post.user_name
+  # of the first post in this topic, for speed
+  created_by = db.StringProperty()
+  # just in case, not used
+  updated_on = db.DateTimeProperty(auto_now=True)
+  # True if first Post in this topic is deleted. Updated on deletion/undeletion
+  # of the post
+  is_deleted = db.BooleanProperty(default=False)
+  # ncomments is redundant but is faster than always quering count of Posts.
+  # It's the number of non-deleted posts, not counting the first post. It's
+  # only updated in a transaction (see update_topic())
+  ncomments = db.IntegerProperty(default=0)
+  # first Post in this topic and a short excerpt of its message, for speed.
+  # Not set for topics created before they were introduced until "topics"
+  # maintenance job is run
+  first_post = db.ReferenceProperty()
+  msg_short = db.StringProperty()
+  # time and author of the most recent non-deleted post, for speed
+  last_post_on = db.DateTimeProperty()
+  last_post_by = db.StringProperty()
+  # True while a topic is being imported by ImportFruitshow. A topic left
+  # with it set is a leftover of an import that failed half-way
+  is_importing = db.BooleanProperty(default=False)
+
+  def set_first_post(self, post):
+    self.first_post = post
+    self.msg_short = make_msg_short(post.message)
+
+  # post can be None if all posts are deleted
+  def set_last_post(self, post):
+    if post:
+      (self.last_post_on, self.last_post_by) = (post.created_on, post.user_name)
+    else:
+      (self.last_post_on, self.last_post_by) = (None, None)
+
+  def first_post_key(self):
+    key = Topic.first_post.get_value_for_datastore(self)
+    if not key:
+      post = Post.gql("WHERE topic = :1 ORDER BY created_on", self).get()
+      if post:
+        key = post.key()
+    return key
+
+  def query_last_post(self):
+    return Post.gql("WHERE topic = :1 AND is_deleted = False ORDER BY created_on DESC", self).get()
+
+# A topic is a collection of posts
+class Post(db.Model):
+  topic = db.Reference(Topic, required=True)
+  forum = db.Reference(Forum, required=True)
+  created_on = db.DateTimeProperty(auto_now_add=True)
+  message = db.TextProperty(required=True)
+  sha1_digest = db.StringProperty(required=True)
+  # admin can delete/undelete posts. If first post in a topic is deleted,
+  # that means the topic is deleted as well
+  is_deleted = db.BooleanProperty(default=False)
+  # ip address from which this post has been made
+  user_ip = db.IntegerProperty(required=True)
+  user = db.Reference(FofouUser, required=True)
+  # user_name, user_email and user_homepage might be different than
+  # name/homepage/email fields in user object, since they can be changed in
+  # FofouUser
+  user_name = db.StringProperty()
+  user_email = db.StringProperty()
+  user_homepage = db.StringProperty()
+  # message rendered to html at write time, so that we don't have to format
+  # it on every view. message_html_version is the MESSAGE_RENDERER_VERSION
+  # it was rendered with
+  message_html = db.TextProperty()
+  message_html_version = db.IntegerProperty(default=0)
+
+  def render_html(self):
+    self.message_html = render_message(self.message)
+    self.message_html_version = MESSAGE_RENDERER_VERSION
+
+  # returns message formatted as html. Posts that haven't been (re)rendered
+  # with current renderer are formatted on the fly
+  def html(self):
+    if self.message_html is not None and self.message_html_version == MESSAGE_RENDERER_VERSION:
+      return self.message_html
+    return render_message(self.message)
+
+# Index of message digests, one entity per distinct message body posted in
+# a forum, with key name "<forum key>:<sha1_digest>" (see digest_key_name()),
+# so that checking for duplicate posts is a get by key. Records who posted
+# the message first, for blocking repeat spam
+class PostDigest(db.Model):
+  forum = db.Reference(Forum, required=True)
+  post = db.Reference(Post)
+  user = db.Reference(FofouUser)
+  user_ip = db.IntegerProperty()
+  created_on = db.DateTimeProperty()
+  # number of times someone tried to post this message again
+  nrepeats = db.IntegerProperty(default=0)
+
+# Per-forum counters (number of non-deleted topics and posts). Every post in
+# a forum updates them, so to avoid contention each counter is split into
+# COUNTER_SHARDS entities and an update only touches a random one of them
+class ForumCounter(db.Model):
+  forum = db.Reference(Forum, required=True)
+  name = db.StringProperty(required=True)
+  count = db.IntegerProperty(default=0)
+
+COUNTER_SHARDS = 10
+
+# Search index of a topic, with key name "t<topic id>" (see
+# topic_index_key_name()). Deleted topics don't have one
+class TopicIndex(db.Model):
+  forum = db.Reference(Forum, required=True)
+  topic = db.Reference(Topic, required=True)
+  # distinct words of topic's subject and its non-deleted posts. Queried
+  # with one equality filter per searched word
+  words = db.StringListProperty()
+  # number of times each word occurs in non-deleted posts, as space separated
+  # "<word>:<count>" pairs, for ranking and for removing words of deleted posts
+  counts = db.TextProperty()
+  last_post_on = db.DateTimeProperty()
+
+  def get_counts(self):
+    counts = {}
+    if self.counts:
+      for pair in self.counts.split(" "):
+        (word, n) = pair.rsplit(":", 1)
+        counts[word] = int(n)
+    return counts
+
+  # every word of the subject is indexed, then most frequent words in posts,
+  # up to SEARCH_MAX_WORDS
+  def set_counts(self, counts, subject_words):
+    self.counts = " ".join(["%s:%d" % (w, n) for (w, n) in counts.items()])
+    words = dict([(w, True) for w in subject_words])
+    by_count = [(n, w) for (w, n) in counts.items() if w not in words]
+    by_count.sort()
+    by_count.reverse()
+    nleft = max(0, SEARCH_MAX_WORDS - len(words))
+    self.words = words.keys() + [w for (n, w) in by_count[:nleft]]
+
+# Rendered page of an archived topic, which only changes when a moderator
+# (un)deletes a post, with key name "<topic id>:<skin>:<viewer>:<page>"
+# (see topic_snapshot_key_name()). The page has LOG_IN_OUT_PLACEHOLDER in
+# place of log in/out links
+class TopicSnapshot(db.Model):
+  forum = db.Reference(Forum, required=True)
+  topic_id = db.IntegerProperty()
+  html = db.BlobProperty()
+  # deflate_parts() of html, empty if compressed responses aren't served
+  gzip_parts = db.ListProperty(db.Blob)
+  # token of the page ("" for the first one) and of the next page, if any
+  page_token = db.StringProperty()
+  next_page = db.StringProperty()
+  # ETag and Last-Modified of the page, minus log in/out links
+  etag = db.StringProperty()
+  last_modified = db.IntegerProperty()
+  # snapshot_fingerprint() at the time the page was rendered
+  fingerprint = db.StringProperty()
+  created_on = db.DateTimeProperty(auto_now_add=True)
+
+# each word is an entry in datastore indexes, whose number is limited per
+# entity
+SEARCH_MAX_WORDS = 1000
+
+# Bump MESSAGE_RENDERER_VERSION after changing render_message() and run
+# "rerender" maintenance job to re-render existing posts
+MESSAGE_RENDERER_VERSION = 1
+
+# formats message body as html, same as striptags|escape|urlize|linebreaksbr
+# filters in a template
+def render_message(msg):
+  return linebreaksbr(urlize(escape(striptags(msg))))
+
+MSG_SHORT_LEN = 100
+
+# returns plain text beginning of a message, for Topic.msg_short
+def make_msg_short(msg):
+  txt = " ".join(striptags(msg).split())
+  if len(txt) > MSG_SHORT_LEN:
+    txt = txt[:MSG_SHORT_LEN] + "..."
+  return txt
@@ -0,0 +1,84 @@
+# This code is in Public Domain. Take all the code you want, we'll just write more.
+import os, math
+from google.appengine.ext import db
+from common import *
+
+# at most that many words of a query are searched for
+SEARCH_MAX_TERMS = 5
+# number of most recently active topics containing the most selective term
+# read from the index, the best of those containing all terms are shown.
+# This bounds the cost of a query regardless of how many topics match
+SEARCH_FETCH_LIMIT = 200
+SEARCH_RESULTS = 25
+# a word in the subject counts as much as that many occurrences in posts
+SUBJECT_WEIGHT = 10
+
+# returns (indexes, more): TopicIndex entities of topics in a forum that
+# contain all terms, out of SEARCH_FETCH_LIMIT most recently active topics
+# containing the longest (likely the rarest) term, and whether there are
+# more topics to look at. Querying on all terms at once would return the
+# first matches in key order, which ranking can't make up for
+def search_topic_indexes(forum, terms):
+  first = max([(len(term), term) for term in terms])[1]
+  q = TopicIndex.gql("WHERE forum = :1 AND words = :2 ORDER BY last_post_on DESC", forum, first)
+  indexes = q.fetch(SEARCH_FETCH_LIMIT)
+  more = len(indexes) == SEARCH_FETCH_LIMIT
+  res = []
+  for index in indexes:
+    words = set(index.words)
+    if not [term for term in terms if term not in words]:
+      res.append(index)
+  return (res, more)
+
+def rank_topic(index, topic, terms):
+  counts = index.get_counts()
+  subject_words = search_words(topic.subject)
+  score = 0.0
+  for term in terms:
+    n = counts.get(term, 0)
+    if term in subject_words:
+      n += SUBJECT_WEIGHT
+    score += math.log(1 + n)
+  return score
+
+# responds to /<forumurl>/search?q=<query>, shows topics containing all words
+# of the query, best matches first
+class SearchForm(FofouHandler):
+
+  def get(self):
+    (forum, siteroot, tmpldir) = forum_siteroot_tmpldir_from_url(self.request.path_info)
+    if not forum or forum.is_disabled:
+      return self.redirect("/")
+    q = self.request.get('q').strip()
+    terms = []
+    for w in search_words(q):
+      if w not in terms:
+        terms.append(w)
+    terms = terms[:SEARCH_MAX_TERMS]
+
+    topics = []
+    more = False
+    if terms:
+      (indexes, more) = search_topic_indexes(forum, terms)
+      topic_keys = [TopicIndex.topic.get_value_for_datastore(index) for index in indexes]
+      ranked = []
+      for (index, topic) in zip(indexes, db.get(topic_keys)):
+        if not topic or topic.is_deleted:
+          continue
+        ranked.append((rank_topic(index, topic, terms), index.last_post_on, topic))
+      ranked.sort()
+      ranked.reverse()
+      topics = [topic for (score, last_post_on, topic) in ranked[:SEARCH_RESULTS]]
+
+    tvals = {
+      'siteroot' : siteroot,
+      'forum' : forum,
+      'analytics_code' : forum.analytics_code or "",
+      'q' : q,
+      'terms' : terms,
+      'topics' : topics,
+      'more' : more,
+      'log_in_out' : get_log_in_out(self.ctx, self.request.url),
+    }
+    tmpl = os.path.join(tmpldir, "search.html")
+    template_out(self.response, tmpl, tvals)
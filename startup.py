@@ -0,0 +1,45 @@
+# This code is in Public Domain. Take all the code you want, we'll just write more.
+import os, sys, time, logging
+
+# Startup timing. The first request handled by a new instance pays for
+# importing all the code it needs, so modules are imported with
+# timed_import() which records how long each took. Handlers that are rarely
+# used (feeds, import, admin pages) live in their own modules and are only
+# imported when their url is hit, see lazy_handler().
+
+g_start = time.time()
+
+# list of (module name, import time in ms), in order of import
+g_import_times = []
+
+# True once log_startup_times() has been called, later imports are lazy
+g_startup_logged = False
+
+def timed_import(module_name):
+  if module_name not in sys.modules:
+    start = time.time()
+    __import__(module_name)
+    dur = (time.time() - start) * 1000.0
+    g_import_times.append((module_name, dur))
+    if g_startup_logged:
+      logging.info("startup: lazy import of %s took %.1f ms" % (module_name, dur))
+  return sys.modules[module_name]
+
+# logs one line with import time of each module, so that it can be compared
+# across releases (CURRENT_VERSION_ID is the deployed version)
+def log_startup_times():
+  global g_startup_logged
+  total = (time.time() - g_start) * 1000.0
+  details = ", ".join(["%s: %.1f ms" % (name, dur) for (name, dur) in g_import_times])
+  version = os.environ.get("CURRENT_VERSION_ID", "unknown")
+  logging.info("startup: version %s, total %.1f ms (%s)" % (version, total, details))
+  g_startup_logged = True
+
+# Returns a factory that webapp.WSGIApplication can use in place of a handler
+# class (it only calls it to create a handler instance). The module is
+# imported on the first request to the handler's url
+def lazy_handler(module_name, class_name):
+  def create():
+    return getattr(timed_import(module_name), class_name)()
+  create.__name__ = class_name
+  return create
@@ -39,3 +39,14 @@ function rolloverOff()
 		document.images[__rolloverOut].src = __rolloverOutSrc;	
 	}
 }
+
+// Links to posts used to be topic?id=<id>#<post id>. Long topics are split
+// into pages, so if the post isn't on this page, we ask the server to
+// redirect to the page with it
+function resolvePermalink(topicUrl) {
+	var hash = window.location.hash;
+	if (!hash || !/^#\d+$/.test(hash)) return;
+	var postId = hash.substring(1);
+	if (document.getElementsByName(postId).length > 0) return;
+	window.location.replace(topicUrl + "&post=" + postId);
+}
@@ -0,0 +1,74 @@
+// Shows a fofou forum inside a page on another site, using JSON api
+// (/<forum>/api/topics and /<forum>/api/topic?id=<id>). Usage:
+//
+//   <div id="forum"></div>
+//   <script src="http://<fofou host>/static/fofou_api.js"></script>
+//   <script>fofouShowTopics("http://<fofou host>/<forum>/", "forum");</script>
+//
+// Only one forum can be shown on a page.
+
+var fofouSiteroot;
+var fofouElementId;
+var fofouCallbackNo = 0;
+
+function fofouEscape(s) {
+	if (!s) return "";
+	return String(s).replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;").replace(/"/g, "&quot;");
+}
+
+// calls fn with data returned by api url, as JSONP
+function fofouLoad(url, fn) {
+	var name = "fofouCallback" + (fofouCallbackNo++);
+	var script = document.createElement("script");
+	window[name] = function(data) {
+		window[name] = undefined;
+		script.parentNode.removeChild(script);
+		fn(data);
+	};
+	script.src = url + (url.indexOf("?") == -1 ? "?" : "&") + "callback=" + name;
+	document.getElementsByTagName("head")[0].appendChild(script);
+}
+
+function fofouShowTopics(siteroot, elementId, after) {
+	fofouSiteroot = siteroot;
+	fofouElementId = elementId;
+	var url = siteroot + "api/topics";
+	if (after) url += "?after=" + encodeURIComponent(after);
+	fofouLoad(url, function(data) {
+		var html = [];
+		for (var i = 0; i < data.topics.length; i++) {
+			var t = data.topics[i];
+			html.push('<div class="topic"><a href="' + siteroot + 'topic?id=' + t.id + '" title="' + fofouEscape(t.msg_short) + '" onclick="fofouShowTopic(' + t.id + '); return false;">' + fofouEscape(t.subject) + '</a>');
+			html.push(' <em>' + fofouEscape(t.created_by) + '</em> <span>(' + t.ncomments + ')</span></div>');
+		}
+		if (data.next) {
+			html.push('<div class="buttons"><a href="#" onclick="fofouShowTopics(fofouSiteroot, fofouElementId, \'' + data.next + '\'); return false;">Older topics</a></div>');
+		}
+		document.getElementById(elementId).innerHTML = html.join("");
+	});
+}
+
+function fofouShowTopic(topicId, after) {
+	var url = fofouSiteroot + "api/topic?id=" + topicId;
+	if (after) url += "&after=" + encodeURIComponent(after);
+	fofouLoad(url, function(data) {
+		var html = [];
+		html.push('<h3>' + fofouEscape(data.topic.subject) + '</h3>');
+		for (var i = 0; i < data.posts.length; i++) {
+			var p = data.posts[i];
+			html.push('<div class="post">' + p.html + '</div><div class="author">');
+			if (p.user_homepage)
+				html.push('<a href="' + fofouEscape(p.user_homepage) + '">' + fofouEscape(p.user_name) + '</a>');
+			else
+				html.push(fofouEscape(p.user_name));
+			html.push(' ' + p.created_on.replace("T", " ").replace("Z", " UTC") + '</div>');
+		}
+		html.push('<div class="buttons"><a href="#" onclick="fofouShowTopics(fofouSiteroot, fofouElementId); return false;">All topics</a>');
+		if (data.next)
+			html.push(' <a href="#" onclick="fofouShowTopic(' + data.topic.id + ', \'' + data.next + '\'); return false;">More posts</a>');
+		if (!data.archived)
+			html.push(' <a href="' + fofouSiteroot + 'post?id=' + data.topic.id + '">Reply</a>');
+		html.push('</div>');
+		document.getElementById(fofouElementId).innerHTML = html.join("");
+	});
+}